@@ -1,5 +1,12 @@
+import asyncio
 import datetime
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import timedelta
+from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
@@ -8,20 +15,108 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.models import User
 from app.database import get_db
+from app.metrics import AUTH_CACHE_LOOKUPS
 
 SECRET_KEY = "NG5U32385GN5G2U3NP223"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", "60"))
+TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() == "true"
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    name: str
+    email: Optional[str] = None
+
+
+class UserCache:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, CurrentUser]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subject: str) -> Optional[CurrentUser]:
+        entry = self.entries.get(subject)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[subject]
+            self.misses += 1
+            AUTH_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        self.entries.move_to_end(subject)
+        self.hits += 1
+        AUTH_CACHE_LOOKUPS.labels("hit").inc()
+        return entry[1]
+
+    def set(self, subject: str, user: CurrentUser):
+        self.entries[subject] = (time.monotonic() + self.ttl, user)
+        self.entries.move_to_end(subject)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, subject: Optional[str] = None):
+        if subject is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(subject, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+user_cache = UserCache()
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        return await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Password service is busy",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+password_hasher = PasswordHasher()
+
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -41,8 +136,12 @@ async def authenticate_user(db: AsyncSession, username: str, password: str):
     user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user.password)
+    if not verified:
         return False
+    if new_hash is not None:
+        user.password = new_hash
+        await db.commit()
     return user
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
@@ -53,12 +152,22 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+        subject: str = payload.get("sub")
+        if subject is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = await get_user(db, email)
+
+    user_id = payload.get("uid")
+    if TRUST_TOKEN_CLAIMS and user_id is not None:
+        return CurrentUser(id=user_id, name=subject)
+
+    current_user = user_cache.get(subject)
+    if current_user is not None:
+        return current_user
+    user = await get_user(db, subject)
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    current_user = CurrentUser(id=user.id, name=user.name, email=user.email)
+    user_cache.set(subject, current_user)
+    return current_user
\ No newline at end of file
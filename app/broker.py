@@ -0,0 +1,219 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+from uuid import uuid4
+
+import asyncpg
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.database import DATABASE_URL
+
+BROKER_BACKEND = os.getenv("WS_BROKER", "memory")
+
+# NOTIFY payloads must be shorter than 8000 bytes. Larger payloads are split
+# into chunks sent in one transaction, which Postgres delivers contiguously.
+NOTIFY_PAYLOAD_LIMIT = 8000
+CHUNK_MARKER = "~chunk:"
+# Four bytes per character at most, plus room for the chunk header.
+CHUNK_CHARS = (NOTIFY_PAYLOAD_LIMIT - 100) // 4
+
+Handler = Callable[[str, str], None]
+ResetHandler = Callable[[], None]
+
+# Deliveries waiting for the transaction they were published in.
+PENDING_DELIVERIES = "broker_pending_deliveries"
+
+
+@event.listens_for(Session, "after_commit")
+def _deliver_pending(session: Session):
+    for deliver in session.info.pop(PENDING_DELIVERIES, ()):
+        deliver()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_pending(session: Session, previous_transaction):
+    session.info.pop(PENDING_DELIVERIES, None)
+
+
+class Broker(ABC):
+    # Whether a publish reaches every process, not only this one.
+    shared = False
+
+    def __init__(self):
+        self.handler: Optional[Handler] = None
+        self.reset_handler: Optional[ResetHandler] = None
+        self.channels: set[str] = set()
+
+    # The reset handler is called whenever deliveries may have been lost.
+    async def start(self, handler: Handler, reset_handler: Optional[ResetHandler] = None):
+        self.handler = handler
+        self.reset_handler = reset_handler
+
+    async def stop(self):
+        self.channels.clear()
+
+    @abstractmethod
+    async def subscribe(self, channel: str):
+        ...
+
+    @abstractmethod
+    async def unsubscribe(self, channel: str):
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, payload: str):
+        ...
+
+    # Publishes as part of the session's transaction: the payload goes out
+    # only if the transaction commits, and a failed publish fails the commit.
+    async def publish_in(self, db: AsyncSession, channel: str, payload: str):
+        db.sync_session.info.setdefault(PENDING_DELIVERIES, []).append(lambda: self._deliver(channel, payload))
+
+    def _deliver(self, channel: str, payload: str):
+        if self.handler is not None and channel in self.channels:
+            self.handler(channel, payload)
+
+    def _reset(self):
+        if self.reset_handler is not None:
+            self.reset_handler()
+
+
+def split_payload(payload: str) -> list[str]:
+    if len(payload.encode()) < NOTIFY_PAYLOAD_LIMIT and not payload.startswith(CHUNK_MARKER):
+        return [payload]
+    parts = [payload[start:start + CHUNK_CHARS] for start in range(0, len(payload), CHUNK_CHARS)] or [""]
+    publish_id = uuid4().hex
+    return [f"{CHUNK_MARKER}{publish_id}:{index}:{len(parts)}:{part}" for index, part in enumerate(parts)]
+
+
+class ChunkAssembler:
+    def __init__(self):
+        self.partial: dict[tuple[str, str], list[str]] = {}
+
+    # Returns the whole payload once its last chunk arrives, otherwise None.
+    def feed(self, channel: str, payload: str) -> Optional[str]:
+        if not payload.startswith(CHUNK_MARKER):
+            return payload
+        publish_id, index, count, part = payload[len(CHUNK_MARKER):].split(":", 3)
+        key = (channel, publish_id)
+        parts = self.partial.setdefault(key, [])
+        if int(index) != len(parts):
+            # A chunk went missing; the payload cannot be rebuilt.
+            del self.partial[key]
+            return None
+        parts.append(part)
+        if len(parts) < int(count):
+            return None
+        del self.partial[key]
+        return "".join(parts)
+
+    def clear(self):
+        self.partial.clear()
+
+
+class InMemoryBroker(Broker):
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+    async def publish(self, channel: str, payload: str):
+        self._deliver(channel, payload)
+
+
+class PostgresBroker(Broker):
+    shared = True
+
+    def __init__(self, dsn: str, pool_size: int = 4):
+        super().__init__()
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self.listener: Optional[asyncpg.Connection] = None
+        self.pool: Optional[asyncpg.Pool] = None
+        self.lock = asyncio.Lock()
+        self.assembler = ChunkAssembler()
+
+    async def start(self, handler: Handler, reset_handler: Optional[ResetHandler] = None):
+        await super().start(handler, reset_handler)
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=self.pool_size)
+        await self._connect_listener()
+
+    async def stop(self):
+        async with self.lock:
+            if self.listener is not None:
+                await self.listener.close()
+                self.listener = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        await super().stop()
+
+    async def subscribe(self, channel: str):
+        async with self.lock:
+            if channel in self.channels:
+                return
+            await self.listener.add_listener(channel, self._on_notify)
+            self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        async with self.lock:
+            if channel not in self.channels:
+                return
+            self.channels.discard(channel)
+            if self.listener is not None and not self.listener.is_closed():
+                await self.listener.remove_listener(channel, self._on_notify)
+
+    async def publish(self, channel: str, payload: str):
+        chunks = split_payload(payload)
+        if len(chunks) == 1:
+            await self.pool.execute("SELECT pg_notify($1, $2)", channel, chunks[0])
+            return
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for chunk in chunks:
+                    await conn.execute("SELECT pg_notify($1, $2)", channel, chunk)
+
+    # NOTIFY is transactional: Postgres delivers it on commit, in commit order.
+    async def publish_in(self, db: AsyncSession, channel: str, payload: str):
+        for chunk in split_payload(payload):
+            await db.execute(select(func.pg_notify(channel, chunk)))
+
+    async def _connect_listener(self):
+        async with self.lock:
+            self.listener = await asyncpg.connect(self.dsn)
+            self.listener.add_termination_listener(self._on_terminate)
+            for channel in self.channels:
+                await self.listener.add_listener(channel, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        payload = self.assembler.feed(channel, payload)
+        if payload is not None:
+            self._deliver(channel, payload)
+
+    def _on_terminate(self, connection):
+        if self.listener is connection and self.pool is not None:
+            self.assembler.clear()
+            self._reset()
+            asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while self.pool is not None:
+            try:
+                await self._connect_listener()
+                # Notifications sent while the listener was down are gone.
+                self._reset()
+                return
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(1)
+
+
+def create_broker(backend: str = BROKER_BACKEND) -> Broker:
+    if backend == "memory":
+        return InMemoryBroker()
+    if backend == "postgres":
+        return PostgresBroker(DATABASE_URL.replace("+asyncpg", ""))
+    raise ValueError(f"Unknown broker backend: {backend}")
@@ -1,13 +1,66 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import os
+
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
-DATABASE_URL = "postgresql+asyncpg://user:password@db:5432/chat_db"
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://user:password@db:5432/chat_db")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "100"))
+
+
+def build_engine(url: str) -> AsyncEngine:
+    connect_args = {"prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE}
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+engine = build_engine(DATABASE_URL)
+replica_engine = build_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else engine
 
-engine = create_async_engine(DATABASE_URL, echo=True)
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+async_replica_session = sessionmaker(
+    replica_engine, class_=AsyncSession, expire_on_commit=False
+)
 
 async def get_db():
     async with async_session() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+async def get_replica_db():
+    async with async_replica_session() as session:
+        yield session
+
+
+def _pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.sync_engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+
+def pool_stats() -> dict:
+    stats = {"primary": _pool_stats(engine)}
+    if replica_engine is not engine:
+        stats["replica"] = _pool_stats(replica_engine)
+    return stats
@@ -0,0 +1,77 @@
+import csv
+import io
+import os
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+import orjson
+from sqlalchemy import tuple_
+from sqlalchemy.future import select
+
+from app.database import async_replica_session
+from app.serializers import MESSAGE_TABLES, message_payload
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+NDJSON = "ndjson"
+CSV = "csv"
+
+MEDIA_TYPES = {
+    NDJSON: "application/x-ndjson",
+    CSV: "text/csv",
+}
+
+_fields = ["id", "kind", "chat_id", "sender_id", "text", "timestamp", "read", "client_msg_id"]
+
+
+def _csv_row(message) -> dict:
+    row = message_payload(message)
+    row["timestamp"] = message.timestamp.isoformat()
+    return row
+
+
+async def _stream(
+    kind: str, conversation_id: int, since: Optional[datetime], until: Optional[datetime]
+) -> AsyncIterator[list]:
+    model, conversation_column, columns = MESSAGE_TABLES[kind]
+    query = select(*columns).where(conversation_column == conversation_id)
+    if since is not None:
+        query = query.where(model.timestamp >= since)
+    if until is not None:
+        query = query.where(model.timestamp < until)
+    query = query.order_by(model.timestamp.asc(), model.id.asc()).limit(EXPORT_BATCH_SIZE)
+
+    # Each batch is read in its own short transaction and resumes after the
+    # last row, so a slow client never pins a connection or an old snapshot.
+    position = None
+    while True:
+        batch = query if position is None else query.where(tuple_(model.timestamp, model.id) > tuple_(*position))
+        async with async_replica_session() as db:
+            rows = (await db.execute(batch)).all()
+        if rows:
+            yield rows
+        if len(rows) < EXPORT_BATCH_SIZE:
+            return
+        position = rows[-1].timestamp, rows[-1].id
+
+
+async def export_messages(
+    kind: str,
+    conversation_id: int,
+    fmt: str = NDJSON,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> AsyncIterator[bytes]:
+    if fmt == CSV:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=_fields)
+        writer.writeheader()
+        yield buffer.getvalue().encode()
+        async for partition in _stream(kind, conversation_id, since, until):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(_csv_row(message) for message in partition)
+            yield buffer.getvalue().encode()
+    else:
+        async for partition in _stream(kind, conversation_id, since, until):
+            yield b"".join(orjson.dumps(message_payload(message)) + b"\n" for message in partition)
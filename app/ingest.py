@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlalchemy.exc import DBAPIError
+
+from app.database import async_session
+from app.membership import CHAT
+from app.metrics import INGEST_QUEUE_DEPTH, INGEST_BATCH_MESSAGES, INGEST_FLUSH_SECONDS, INGEST_REJECTED
+from app.repository import insert_messages
+from app.schemas import MessageCreate
+from app.serializers import MessageRecord, message_event
+from app.tail_cache import tail_cache
+from app.websocket_manager import manager
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL_MS = float(os.getenv("INGEST_FLUSH_INTERVAL_MS", "5"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+# Suggested pause for clients refused because the queue is full.
+INGEST_RETRY_AFTER = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+# Raised to the sender; the socket stays open and gets an error frame.
+class IngestError(Exception):
+    retry_after: Optional[float] = None
+
+
+class IngestOverloaded(IngestError):
+    def __init__(self, retry_after: float = INGEST_RETRY_AFTER):
+        super().__init__("Server is overloaded")
+        self.retry_after = retry_after
+
+
+class IngestFailed(IngestError):
+    def __init__(self):
+        super().__init__("Message could not be saved")
+
+
+class MessageIngest:
+    def __init__(
+        self,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_interval_ms: float = INGEST_FLUSH_INTERVAL_MS,
+        queue_size: int = INGEST_QUEUE_SIZE
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue_size = queue_size
+        self.queue: Optional[asyncio.Queue] = None
+        # Messages taken off the queue but not yet resolved.
+        self.batch: list = []
+        self.worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        pending, self.batch = self.batch, []
+        while self.queue is not None and not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        self._fail(pending, RuntimeError("Message ingest stopped"))
+
+    async def submit(self, message_in: MessageCreate, kind: str = CHAT) -> MessageRecord:
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((message_in, kind, future))
+        except asyncio.QueueFull:
+            INGEST_REJECTED.inc()
+            raise IngestOverloaded()
+        INGEST_QUEUE_DEPTH.set(self.queue.qsize())
+        try:
+            return await future
+        except Exception as exc:
+            raise IngestFailed() from exc
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self.batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            INGEST_QUEUE_DEPTH.set(self.queue.qsize())
+            INGEST_BATCH_MESSAGES.observe(len(batch))
+            started = time.perf_counter()
+            await self._flush(batch)
+            self.batch = []
+            INGEST_FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+    async def _flush(self, batch: list):
+        by_kind: dict[str, list] = {}
+        for item in batch:
+            by_kind.setdefault(item[1], []).append(item)
+        try:
+            async with async_session() as db:
+                delivered = []
+                for kind, items in by_kind.items():
+                    messages = await insert_messages(db, [message_in for message_in, _, _ in items], kind)
+                    delivered.extend(zip(items, messages))
+                # A replayed key returns a message already in the batch or
+                # stored earlier; publishing it again is harmless, twice is not useful.
+                published = set()
+                for _, message in delivered:
+                    if (message.kind, message.id) not in published:
+                        published.add((message.kind, message.id))
+                        await manager.broadcast_in(db, message.kind, message.chat_id, message_event(message))
+                await db.commit()
+        except DBAPIError as exc:
+            # One bad row must not fail the whole batch: retry rows one by one.
+            if len(batch) == 1:
+                self._fail(batch, exc)
+                return
+            for item in batch:
+                await self._flush([item])
+            return
+        except Exception as exc:
+            self._fail(batch, exc)
+            return
+        tail_cache.add(message for _, message in delivered)
+        for (_, _, future), message in delivered:
+            if not future.done():
+                future.set_result(message)
+
+    @staticmethod
+    def _fail(batch: list, exc: Exception):
+        logger.error("Failed to write %d message(s)", len(batch), exc_info=exc)
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+ingest = MessageIngest()
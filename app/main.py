@@ -1,9 +1,21 @@
-from fastapi import FastAPI
+import os
+
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
 from app import router
 from app.database import engine
 from app.models import Base
+from app.websocket_manager import manager
+from app.ingest import ingest
+from app.presence import presence
+from app.migrate import verify_schema
+from app.partitions import create_partitions
+from app.repository import NotFoundError, NotMemberError
+from app.metrics import MetricsMiddleware, metrics_response
+
+SCHEMA_STARTUP_MODE = os.getenv("SCHEMA_STARTUP_MODE", "verify")
 
 app = FastAPI(title="Chat",
               docs_url="/docs",
@@ -17,9 +29,41 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(router.router)
 
+
+@app.exception_handler(NotFoundError)
+async def not_found(request: Request, exc: NotFoundError):
+    return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"detail": str(exc)})
+
+
+@app.exception_handler(NotMemberError)
+async def not_member(request: Request, exc: NotMemberError):
+    return JSONResponse(status_code=status.HTTP_403_FORBIDDEN, content={"detail": str(exc)})
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
+
 @app.on_event("startup")
 async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+    if SCHEMA_STARTUP_MODE == "verify":
+        await verify_schema(engine)
+    elif SCHEMA_STARTUP_MODE == "create":
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await create_partitions(conn)
+    await manager.start()
+    await presence.start()
+    await ingest.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await ingest.stop()
+    await presence.stop()
+    await manager.stop()
@@ -0,0 +1,53 @@
+import os
+from collections import OrderedDict
+from typing import Iterable
+
+from sqlalchemy import exists
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models import Chat_Users, Group_Users
+
+CHAT = "chat"
+GROUP = "group"
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "100000"))
+
+_columns = {
+    CHAT: (Chat_Users.c.chat_id, Chat_Users.c.user_id),
+    GROUP: (Group_Users.c.group_id, Group_Users.c.user_id),
+}
+
+
+class MembershipService:
+    # Members are never removed from chats or groups, so only positive answers
+    # are cached; a miss always falls through to an EXISTS on the primary key.
+    def __init__(self, maxsize: int = MEMBERSHIP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.members: OrderedDict[tuple[str, int, int], None] = OrderedDict()
+
+    async def is_member(self, db: AsyncSession, kind: str, conversation_id: int, user_id: int) -> bool:
+        key = (kind, conversation_id, user_id)
+        if key in self.members:
+            self.members.move_to_end(key)
+            return True
+
+        conversation_column, user_column = _columns[kind]
+        query = select(exists().where(conversation_column == conversation_id, user_column == user_id))
+        result = await db.execute(query)
+        if not result.scalar():
+            return False
+        self._remember(key)
+        return True
+
+    def add(self, kind: str, conversation_id: int, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            self._remember((kind, conversation_id, user_id))
+
+    def _remember(self, key: tuple[str, int, int]):
+        self.members[key] = None
+        self.members.move_to_end(key)
+        while len(self.members) > self.maxsize:
+            self.members.popitem(last=False)
+
+membership = MembershipService()
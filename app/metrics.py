@@ -0,0 +1,163 @@
+import cProfile
+import functools
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+from starlette.responses import Response
+
+from app.database import engine, replica_engine
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/chat-profiles")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route", "status"]
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries per HTTP request", ["route"],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55)
+)
+REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Database time per HTTP request", ["route"]
+)
+DB_QUERIES = Counter("db_queries_total", "Database queries executed")
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database query latency")
+REPOSITORY_LATENCY = Histogram(
+    "repository_call_duration_seconds", "Repository function latency", ["function"]
+)
+WS_CONNECTIONS = Gauge("websocket_connections", "Active WebSocket connections in this process")
+WS_SUBSCRIPTIONS = Gauge("websocket_subscriptions", "Conversation subscriptions held by local sockets")
+WS_CONNECTIONS_REAPED = Counter(
+    "websocket_connections_reaped_total", "WebSocket connections dropped by the server", ["reason"]
+)
+PRESENCE_ONLINE_USERS = Gauge("presence_online_users", "Users with an open WebSocket in this process")
+PRESENCE_FLUSH_USERS = Histogram(
+    "presence_flush_users", "Users written per presence flush", buckets=(1, 10, 100, 1000, 10000, 100000)
+)
+BROADCAST_FANOUT = Histogram(
+    "broadcast_fanout", "Local sockets a broadcast is delivered to",
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+BROADCAST_PUBLISH_ERRORS = Counter("broadcast_publish_errors_total", "Broadcasts the broker failed to publish")
+BROADCAST_SECONDS = Histogram("broadcast_duration_seconds", "Time to enqueue a broadcast to local sockets")
+INGEST_QUEUE_DEPTH = Gauge("ingest_queue_depth", "Messages waiting in the ingest queue")
+INGEST_BATCH_MESSAGES = Histogram(
+    "ingest_batch_size", "Messages per ingest flush", buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+INGEST_FLUSH_SECONDS = Histogram("ingest_flush_duration_seconds", "Ingest batch write latency")
+INGEST_REJECTED = Counter("ingest_rejected_total", "Messages refused because the ingest queue was full")
+TAIL_CACHE_LOOKUPS = Counter("tail_cache_lookups_total", "History reads tried against the tail cache", ["result"])
+TAIL_CACHE_BYTES = Gauge("tail_cache_bytes", "Estimated size of the messages held by the tail cache")
+AUTH_CACHE_LOOKUPS = Counter("auth_user_cache_lookups_total", "Authenticated user cache lookups", ["result"])
+RATE_LIMIT_DECISIONS = Counter("rate_limit_decisions_total", "Rate limiter decisions", ["limiter", "result"])
+RATE_LIMIT_ERRORS = Counter("rate_limit_backend_errors_total", "Rate limiter backend failures", ["limiter"])
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERIES.inc()
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+for _engine in {engine.sync_engine, replica_engine.sync_engine}:
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def instrument(func):
+    histogram = REPOSITORY_LATENCY.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.route_paths: Optional[dict] = None
+        self.profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+        profiler = self._start_profiler()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _query_stats.reset(token)
+            route = self._route(scope)
+            if profiler is not None:
+                self._stop_profiler(profiler, route)
+            REQUEST_LATENCY.labels(scope["method"], route, status_code).observe(elapsed)
+            REQUEST_DB_QUERIES.labels(route).observe(stats.count)
+            REQUEST_DB_SECONDS.labels(route).observe(stats.seconds)
+
+    def _route(self, scope) -> str:
+        if self.route_paths is None:
+            self.route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+    # Only one request is profiled at a time: cProfile cannot run nested
+    # profilers, and on a single event loop the profile also includes whatever
+    # other coroutines ran while the sampled request was awaiting.
+    def _start_profiler(self) -> Optional[cProfile.Profile]:
+        if self.profiling or PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        self.profiling = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler: cProfile.Profile, route: str):
+        profiler.disable()
+        self.profiling = False
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}-{time.time_ns()}.prof"))
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
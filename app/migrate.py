@@ -0,0 +1,59 @@
+import argparse
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+
+def get_config() -> Config:
+    return Config(str(ALEMBIC_INI))
+
+
+def get_head_revision() -> str:
+    return ScriptDirectory.from_config(get_config()).get_current_head()
+
+
+async def get_current_revision(engine: AsyncEngine) -> str:
+    async with engine.connect() as conn:
+        return await conn.run_sync(lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision())
+
+
+async def verify_schema(engine: AsyncEngine):
+    current = await get_current_revision(engine)
+    head = get_head_revision()
+    if current != head:
+        raise RuntimeError(
+            f"Database schema is at revision {current}, expected {head}. "
+            f"Run `python -m app.migrate upgrade` before starting the app."
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply chat database migrations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    upgrade = subparsers.add_parser("upgrade", help="Upgrade the schema")
+    upgrade.add_argument("revision", nargs="?", default="head")
+    downgrade = subparsers.add_parser("downgrade", help="Downgrade the schema")
+    downgrade.add_argument("revision")
+    subparsers.add_parser("current", help="Show the current revision")
+    subparsers.add_parser("history", help="Show the migration history")
+    args = parser.parse_args(argv)
+
+    config = get_config()
+    if args.command == "upgrade":
+        command.upgrade(config, args.revision)
+    elif args.command == "downgrade":
+        command.downgrade(config, args.revision)
+    elif args.command == "current":
+        command.current(config)
+    elif args.command == "history":
+        command.history(config)
+
+
+if __name__ == "__main__":
+    main()
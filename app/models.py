@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Float, ForeignKey, Table, Index, Computed, Sequence, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime, timezone
 
 Base = declarative_base()
 
@@ -9,28 +9,38 @@ Group_Users = Table(
     'group_users',
     Base.metadata,
     Column('group_id', Integer, ForeignKey('groups.id'), primary_key=True),
-    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True)
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True, index=True),
+    Column('read_count', BigInteger, nullable=False, default=0, server_default='0'),
+    Column('last_read_message_id', Integer, nullable=True)
 )
 
 Chat_Users = Table(
     'chat_users',
     Base.metadata,
     Column('chat_id', Integer, ForeignKey('chats.id'), primary_key=True),
-    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True)
+    Column('user_id', Integer, ForeignKey('users.id'), primary_key=True, index=True),
+    Column('read_count', BigInteger, nullable=False, default=0, server_default='0'),
+    Column('last_read_message_id', Integer, nullable=True)
 )
 
 class User(Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
     password = Column(String, nullable=False)
+    last_seen_at = Column(DateTime(timezone=True), nullable=True)
 
 class Chat(Base):
     __tablename__ = 'chats'
 
     id = Column(Integer, primary_key=True, index=True)
+    message_count = Column(BigInteger, nullable=False, default=0, server_default='0')
+    # Maintained by the message write path; last_activity_at equals the last
+    # message's timestamp, so the pair addresses it inside one partition.
+    last_message_id = Column(Integer, nullable=True)
+    last_activity_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     participants = relationship("User", secondary=Chat_Users)
 
 class Group(Base):
@@ -39,30 +49,74 @@ class Group(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     creator_id = Column(Integer, ForeignKey('users.id'))
+    message_count = Column(BigInteger, nullable=False, default=0, server_default='0')
+    last_message_id = Column(Integer, nullable=True)
+    last_activity_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     creator = relationship("User")
     participants = relationship("User", secondary=Group_Users)
 
+# Messages are range-partitioned by timestamp, so the partition key is part
+# of the primary key. Partitions are managed by app/partitions.py.
 class Message(Base):
     __tablename__ = 'messages'
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, Sequence('messages_id_seq'), primary_key=True)
     chat_id = Column(Integer, ForeignKey('chats.id'), nullable=False)
     sender_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     text = Column(String, nullable=False)
-    timestamp = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    timestamp = Column(DateTime(timezone=True), primary_key=True, default=func.now())
     read = Column(Boolean, default=False)
+    client_msg_id = Column(String, nullable=True)
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('simple', text)", persisted=True)))
 
     sender = relationship("User")
 
+    __table_args__ = (
+        Index("ix_messages_chat_id_timestamp_id", "chat_id", "timestamp", "id"),
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin"),
+        {"postgresql_partition_by": 'RANGE ("timestamp")'},
+    )
+
 class GroupMessage(Base):
     __tablename__ = 'group_messages'
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, Sequence('group_messages_id_seq'), primary_key=True)
     group_id = Column(Integer, ForeignKey('groups.id'), nullable=False)
-    chat_id = Column(Integer, ForeignKey('chats.id'), nullable=False)
     sender_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     text = Column(String, nullable=False)
-    timestamp = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    timestamp = Column(DateTime(timezone=True), primary_key=True, default=func.now())
     read = Column(Boolean, default=False)
+    client_msg_id = Column(String, nullable=True)
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('simple', text)", persisted=True)))
+
+    sender = relationship("User")
+
+    __table_args__ = (
+        Index("ix_group_messages_group_id_timestamp_id", "group_id", "timestamp", "id"),
+        Index("ix_group_messages_search_vector", "search_vector", postgresql_using="gin"),
+        {"postgresql_partition_by": 'RANGE ("timestamp")'},
+    )
+
+# Partitioned tables cannot enforce a unique (sender_id, client_msg_id), so
+# idempotency keys live here and point at the message they created.
+class MessageKey(Base):
+    __tablename__ = 'message_keys'
+
+    kind = Column(String, primary_key=True)
+    conversation_id = Column(Integer, primary_key=True)
+    sender_id = Column(Integer, primary_key=True)
+    client_msg_id = Column(String, primary_key=True)
+    message_id = Column(Integer, nullable=False)
+    timestamp = Column(DateTime(timezone=True), nullable=False, index=True)
+
+# Token buckets shared between workers by the postgres rate limit backend.
+# Losing them on a crash only resets the limits, so the table skips the WAL.
+class RateLimit(Base):
+    __tablename__ = 'rate_limits'
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    allowed = Column(Boolean, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, index=True)
 
-    sender = relationship("User")
\ No newline at end of file
+    __table_args__ = {"prefixes": ["UNLOGGED"]}
@@ -0,0 +1,78 @@
+import base64
+import json
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+
+def _encode(values: list) -> str:
+    raw = json.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> list:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    return json.loads(raw)
+
+
+def encode_cursor(timestamp: datetime, message_id: int) -> str:
+    return _encode([timestamp.isoformat(), message_id])
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if cursor is None:
+        return None
+    try:
+        timestamp, message_id = _decode(cursor)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
+
+
+def encode_sync_cursor(positions: Dict[str, Tuple[datetime, int]]) -> str:
+    return _encode({
+        kind: [timestamp.isoformat(), message_id] for kind, (timestamp, message_id) in positions.items()
+    })
+
+
+def decode_sync_cursor(cursor: Optional[str]) -> Optional[Dict[str, Tuple[datetime, int]]]:
+    if cursor is None:
+        return None
+    try:
+        positions = _decode(cursor)
+        if isinstance(positions, list):
+            # Cursors issued before group messages got their own table.
+            positions = {"chat": positions}
+        return {
+            kind: (datetime.fromisoformat(timestamp), int(message_id))
+            for kind, (timestamp, message_id) in positions.items()
+        }
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("Некорректный курсор")
+
+
+def encode_rank_cursor(rank: float, kind: str, message_id: int) -> str:
+    return _encode([rank, kind, message_id])
+
+
+def decode_rank_cursor(cursor: Optional[str]) -> Optional[Tuple[float, str, int]]:
+    if cursor is None:
+        return None
+    try:
+        rank, kind, message_id = _decode(cursor)
+        return float(rank), str(kind), int(message_id)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
+
+
+def encode_activity_cursor(timestamp: datetime, kind: str, conversation_id: int) -> str:
+    return _encode([timestamp.isoformat(), kind, conversation_id])
+
+
+def decode_activity_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, str, int]]:
+    if cursor is None:
+        return None
+    try:
+        timestamp, kind, conversation_id = _decode(cursor)
+        return datetime.fromisoformat(timestamp), str(kind), int(conversation_id)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор")
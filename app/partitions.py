@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.database import engine
+from app.models import Message, GroupMessage, MessageKey, RateLimit
+
+PARTITIONED_TABLES = (Message.__tablename__, GroupMessage.__tablename__)
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))
+MESSAGE_KEY_RETENTION_DAYS = int(os.getenv("MESSAGE_KEY_RETENTION_DAYS", "7"))
+# An idle bucket is refilled to its burst long before this, and a missing
+# row starts at the burst too, so deleting it changes no decision.
+RATE_LIMIT_IDLE = timedelta(hours=1)
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def partition_month(table: str, name: str) -> Optional[date]:
+    try:
+        return datetime.strptime(name[len(table) + 1:], "%Y_%m").date()
+    except ValueError:
+        return None
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+async def list_partitions(conn: AsyncConnection, table: str) -> list[str]:
+    result = await conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"
+        ),
+        {"table": table}
+    )
+    return result.scalars().all()
+
+
+async def create_partitions(
+    conn: AsyncConnection, months_ahead: int = PARTITION_MONTHS_AHEAD, today: Optional[date] = None
+) -> list[str]:
+    # There is deliberately no DEFAULT partition: it would block detaching
+    # CONCURRENTLY, so partitions are always created ahead of time instead.
+    current = month_start(today or _today())
+    created = []
+    for table in PARTITIONED_TABLES:
+        existing = set(await list_partitions(conn, table))
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            name = partition_name(table, month)
+            if name in existing:
+                continue
+            await conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month} 00:00:00+00') TO ('{add_months(month, 1)} 00:00:00+00')"
+            ))
+            created.append(name)
+    return created
+
+
+async def detach_partitions(
+    conn: AsyncConnection, retention_months: int = PARTITION_RETENTION_MONTHS, today: Optional[date] = None
+) -> list[str]:
+    # Detached partitions stay in the database as plain tables, ready to be
+    # dumped and dropped without a bulk DELETE and the vacuum that follows it.
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(today or _today()), -retention_months)
+    detached = []
+    for table in PARTITIONED_TABLES:
+        for name in await list_partitions(conn, table):
+            month = partition_month(table, name)
+            if month is None or month >= cutoff:
+                continue
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name} CONCURRENTLY"))
+            detached.append(name)
+    return detached
+
+
+async def prune_message_keys(conn: AsyncConnection, retention_days: int = MESSAGE_KEY_RETENTION_DAYS) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    result = await conn.execute(delete(MessageKey).where(MessageKey.timestamp < cutoff))
+    return result.rowcount
+
+
+async def prune_rate_limits(conn: AsyncConnection) -> int:
+    cutoff = datetime.now(timezone.utc) - RATE_LIMIT_IDLE
+    result = await conn.execute(delete(RateLimit).where(RateLimit.updated_at < cutoff))
+    return result.rowcount
+
+
+async def run_maintenance(
+    months_ahead: int = PARTITION_MONTHS_AHEAD,
+    retention_months: int = PARTITION_RETENTION_MONTHS,
+    key_retention_days: int = MESSAGE_KEY_RETENTION_DAYS
+) -> dict:
+    # DETACH ... CONCURRENTLY cannot run inside a transaction block.
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Overlapping runs would race on the same CREATE and DETACH statements.
+        await conn.execute(text("SELECT pg_advisory_lock(hashtext('chat:partitions'))"))
+        try:
+            created = await create_partitions(conn, months_ahead)
+            detached = await detach_partitions(conn, retention_months)
+            pruned = await prune_message_keys(conn, key_retention_days)
+            pruned_limits = await prune_rate_limits(conn)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(hashtext('chat:partitions'))"))
+    await engine.dispose()
+    return {"created": created, "detached": detached, "pruned_keys": pruned, "pruned_rate_limits": pruned_limits}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create upcoming and detach expired message partitions")
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    parser.add_argument("--retention-months", type=int, default=PARTITION_RETENTION_MONTHS)
+    parser.add_argument("--key-retention-days", type=int, default=MESSAGE_KEY_RETENTION_DAYS)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_maintenance(args.months_ahead, args.retention_months, args.key_retention_days))
+    for name in report["created"]:
+        print(f"created {name}")
+    for name in report["detached"]:
+        print(f"detached {name}")
+    print(f"pruned {report['pruned_keys']} message keys")
+    print(f"pruned {report['pruned_rate_limits']} idle rate limit buckets")
+
+
+if __name__ == "__main__":
+    main()
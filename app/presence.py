@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import update, values, column, func, Integer, DateTime
+
+from app.database import async_session
+from app.metrics import PRESENCE_ONLINE_USERS, PRESENCE_FLUSH_USERS
+from app.models import User
+
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL_SECONDS", "5"))
+PRESENCE_ONLINE_TTL = float(os.getenv("PRESENCE_ONLINE_TTL_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceRegistry:
+    # Connects and disconnects only mark users as pending; a background task
+    # writes them to users.last_seen_at in one UPDATE per interval. Users with
+    # open sockets are re-written every half TTL, so other processes see them
+    # as online while last_seen_at is fresher than the TTL. This process knows
+    # its own users exactly: a user whose last socket here closed stays offline
+    # unless another process has refreshed last_seen_at since.
+    def __init__(self, flush_interval: float = PRESENCE_FLUSH_INTERVAL, online_ttl: float = PRESENCE_ONLINE_TTL):
+        self.flush_interval = flush_interval
+        self.online_ttl = online_ttl
+        self.connections: dict[int, int] = {}
+        self.pending: dict[int, datetime] = {}
+        self.departed: dict[int, datetime] = {}
+        self.refreshed = 0.0
+        self.worker: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        await self.flush()
+
+    def connected(self, user_id: int):
+        self.connections[user_id] = self.connections.get(user_id, 0) + 1
+        self.departed.pop(user_id, None)
+        self.pending[user_id] = datetime.now(timezone.utc)
+        PRESENCE_ONLINE_USERS.set(len(self.connections))
+
+    def disconnected(self, user_id: int):
+        now = datetime.now(timezone.utc)
+        count = self.connections.get(user_id, 0) - 1
+        if count > 0:
+            self.connections[user_id] = count
+        else:
+            self.connections.pop(user_id, None)
+            self.departed[user_id] = now
+        self.pending[user_id] = now
+        PRESENCE_ONLINE_USERS.set(len(self.connections))
+
+    def status(self, user_id: int, last_seen_at: Optional[datetime]) -> dict:
+        departed = self.departed.get(user_id)
+        online = user_id in self.connections or (
+            last_seen_at is not None
+            and last_seen_at >= datetime.now(timezone.utc) - timedelta(seconds=self.online_ttl)
+            and (departed is None or last_seen_at > departed)
+        )
+        return {"user_id": user_id, "online": online, "last_seen_at": self.pending.get(user_id, last_seen_at)}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
+
+    async def flush(self):
+        if time.monotonic() - self.refreshed >= self.online_ttl / 2:
+            self.refreshed = time.monotonic()
+            now = datetime.now(timezone.utc)
+            for user_id in self.connections:
+                self.pending[user_id] = now
+            # Past the TTL the freshness check alone keeps these users offline.
+            expired = now - timedelta(seconds=self.online_ttl)
+            self.departed = {user_id: left for user_id, left in self.departed.items() if left >= expired}
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        seen = values(
+            column("id", Integer), column("seen", DateTime(timezone=True)), name="seen"
+        ).data(list(pending.items()))
+        users = User.__table__
+        try:
+            async with async_session() as db:
+                await db.execute(
+                    update(users)
+                    .where(users.c.id == seen.c.id)
+                    .values(last_seen_at=func.greatest(func.coalesce(users.c.last_seen_at, seen.c.seen), seen.c.seen))
+                )
+                await db.commit()
+        except Exception:
+            # Keep the batch for the next flush; newer values recorded meanwhile win.
+            for user_id, timestamp in pending.items():
+                self.pending.setdefault(user_id, timestamp)
+            raise
+        PRESENCE_FLUSH_USERS.observe(len(pending))
+
+presence = PresenceRegistry()
@@ -0,0 +1,116 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Iterable, Optional, Union
+
+import msgpack
+import orjson
+
+from app.serializers import dumps
+
+JSON = "chat.json"
+MSGPACK = "chat.msgpack"
+
+Frame = Union[str, bytes]
+
+# MessagePack frames use short field names; keys missing here are sent as is.
+COMPACT_KEYS = {
+    "type": "t",
+    "id": "i",
+    "kind": "k",
+    "chat_id": "c",
+    "sender_id": "s",
+    "text": "x",
+    "timestamp": "ts",
+    "read": "r",
+    "client_msg_id": "m",
+    "ref": "f",
+    "message": "g",
+    "messages": "gs",
+    "next_cursor": "n",
+    "has_more": "h",
+    "error": "e",
+    "retry_after": "ra",
+}
+FULL_KEYS = {short: key for key, short in COMPACT_KEYS.items()}
+# Fields that arrive as ISO strings when a frame is transcoded from the broker's JSON.
+TIMESTAMP_KEYS = {"timestamp"}
+
+
+class Protocol(ABC):
+    name: Optional[str] = None
+
+    @abstractmethod
+    def encode(self, event: dict) -> Frame:
+        ...
+
+    @abstractmethod
+    def decode(self, data: Frame):
+        ...
+
+    # Broker payloads are JSON; this turns one into a frame of this protocol.
+    @abstractmethod
+    def transcode(self, payload: str) -> Frame:
+        ...
+
+
+class JsonProtocol(Protocol):
+    name = JSON
+
+    def encode(self, event: dict) -> Frame:
+        return dumps(event)
+
+    def decode(self, data: Frame):
+        return orjson.loads(data)
+
+    def transcode(self, payload: str) -> Frame:
+        return payload
+
+
+class MsgpackProtocol(Protocol):
+    # Timestamps travel as integer milliseconds since the epoch.
+    name = MSGPACK
+
+    def encode(self, event: dict) -> Frame:
+        return msgpack.packb(_compact(event))
+
+    def decode(self, data: Frame):
+        if isinstance(data, str):
+            raise ValueError("MessagePack frames must be binary")
+        frame = msgpack.unpackb(data)
+        if not isinstance(frame, dict):
+            return frame
+        return {FULL_KEYS.get(key, key): value for key, value in frame.items()}
+
+    def transcode(self, payload: str) -> Frame:
+        return self.encode(orjson.loads(payload))
+
+
+def _compact(value):
+    if isinstance(value, dict):
+        return {COMPACT_KEYS.get(key, key): _compact_field(key, item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return value
+
+
+def _compact_field(key: str, value):
+    if key in TIMESTAMP_KEYS and isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return _compact(value)
+
+
+json_protocol = JsonProtocol()
+msgpack_protocol = MsgpackProtocol()
+
+PROTOCOLS = {protocol.name: protocol for protocol in (json_protocol, msgpack_protocol)}
+
+
+# Picks the first subprotocol the client offers that we speak. JSON without a
+# subprotocol stays the default, so existing clients need no changes.
+def negotiate(offered: Iterable[str]) -> tuple[Protocol, Optional[str]]:
+    for name in offered:
+        if name in PROTOCOLS:
+            return PROTOCOLS[name], name
+    return json_protocol, None
@@ -0,0 +1,169 @@
+import logging
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import case, func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.database import engine
+from app.metrics import RATE_LIMIT_DECISIONS, RATE_LIMIT_ERRORS
+from app.models import RateLimit
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_MEMORY_SIZE = int(os.getenv("RATE_LIMIT_MEMORY_SIZE", "100000"))
+
+SEND_RATE = float(os.getenv("RATE_LIMIT_SEND_RATE", "10"))
+SEND_BURST = float(os.getenv("RATE_LIMIT_SEND_BURST", "20"))
+AUTH_RATE = float(os.getenv("RATE_LIMIT_AUTH_RATE", "0.2"))
+AUTH_BURST = float(os.getenv("RATE_LIMIT_AUTH_BURST", "10"))
+FRAME_RATE = float(os.getenv("RATE_LIMIT_FRAME_RATE", "20"))
+FRAME_BURST = float(os.getenv("RATE_LIMIT_FRAME_BURST", "40"))
+# Behind a reverse proxy every request comes from the proxy's address. The
+# header is only believed when the peer is one of the trusted proxies.
+CLIENT_IP_HEADER = os.getenv("RATE_LIMIT_CLIENT_IP_HEADER", "")
+TRUSTED_PROXIES = {host.strip() for host in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "").split(",") if host.strip()}
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, rate: float, burst: float, cost: float = 1) -> float:
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / rate
+
+
+class RateLimitBackend(ABC):
+    @abstractmethod
+    async def acquire(self, limiter: "RateLimiter", key: str, cost: float = 1) -> float:
+        ...
+
+    def forget(self, limiter: "RateLimiter", key: str):
+        pass
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, maxsize: int = RATE_LIMIT_MEMORY_SIZE):
+        self.maxsize = maxsize
+        self.buckets: OrderedDict[tuple[str, str], TokenBucket] = OrderedDict()
+
+    async def acquire(self, limiter: "RateLimiter", key: str, cost: float = 1) -> float:
+        bucket_key = (limiter.name, key)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self.buckets[bucket_key] = TokenBucket(limiter.burst, time.monotonic())
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(bucket_key)
+        return bucket.take(limiter.rate, limiter.burst, cost)
+
+    def forget(self, limiter: "RateLimiter", key: str):
+        self.buckets.pop((limiter.name, key), None)
+
+
+class PostgresRateLimitBackend(RateLimitBackend):
+    # One upsert per decision: the bucket is refilled, charged and read back
+    # atomically, so workers sharing the table never double-spend tokens.
+    async def acquire(self, limiter: "RateLimiter", key: str, cost: float = 1) -> float:
+        table = RateLimit.__table__
+        elapsed = func.extract("epoch", func.now() - table.c.updated_at)
+        refilled = func.least(limiter.burst, table.c.tokens + elapsed * limiter.rate)
+        query = (
+            insert(table)
+            .values(key=f"{limiter.name}:{key}", tokens=limiter.burst - cost, allowed=True, updated_at=func.now())
+            .on_conflict_do_update(
+                index_elements=[table.c.key],
+                set_={
+                    "tokens": case((refilled >= cost, refilled - cost), else_=refilled),
+                    "allowed": refilled >= cost,
+                    "updated_at": func.now(),
+                }
+            )
+            .returning(table.c.tokens, table.c.allowed)
+        )
+        async with engine.begin() as conn:
+            tokens, allowed = (await conn.execute(query)).one()
+        return 0.0 if allowed else (cost - tokens) / limiter.rate
+
+
+def create_rate_limit_backend(backend: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if backend == "memory":
+        return InMemoryRateLimitBackend()
+    if backend == "postgres":
+        return PostgresRateLimitBackend()
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate: float, burst: float, backend: Optional[RateLimitBackend] = None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.allowed = RATE_LIMIT_DECISIONS.labels(name, "allowed")
+        self.limited = RATE_LIMIT_DECISIONS.labels(name, "limited")
+        self.errors = RATE_LIMIT_ERRORS.labels(name)
+
+    # Returns 0 when allowed, otherwise the seconds until a retry can succeed.
+    async def check(self, key) -> float:
+        if self.rate <= 0:
+            return 0.0
+        try:
+            retry_after = await self.backend.acquire(self, str(key))
+        except Exception:
+            # A broken shared backend must not take the whole API down with it.
+            logger.exception("Rate limiter %s failed, allowing request", self.name)
+            self.errors.inc()
+            return 0.0
+        (self.limited if retry_after > 0 else self.allowed).inc()
+        return retry_after
+
+    async def enforce(self, key):
+        retry_after = await self.check(key)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    def forget(self, key):
+        self.backend.forget(self, str(key))
+
+
+_backend = create_rate_limit_backend()
+
+send_limiter = RateLimiter("send", SEND_RATE, SEND_BURST, _backend)
+auth_limiter = RateLimiter("auth", AUTH_RATE, AUTH_BURST, _backend)
+# A socket only ever lives in one process, so frame buckets stay local.
+frame_limiter = RateLimiter("frame", FRAME_RATE, FRAME_BURST)
+
+
+def client_ip(request: Request) -> str:
+    peer = request.client.host if request.client is not None else "unknown"
+    if not CLIENT_IP_HEADER or not (peer in TRUSTED_PROXIES or "*" in TRUSTED_PROXIES):
+        return peer
+    # The right-most address is the one our proxy saw; anything to its left
+    # came from the client and could be forged.
+    forwarded = request.headers.get(CLIENT_IP_HEADER, "").split(",")[-1].strip()
+    return forwarded or peer
+
+
+async def limit_auth(request: Request):
+    await auth_limiter.enforce(client_ip(request))
@@ -1,53 +1,264 @@
+import os
+from datetime import timedelta
+
 from sqlalchemy.future import select
-from sqlalchemy import or_, distinct, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import (
+    and_, or_, distinct, func, tuple_, update, exists, values, column, literal_column, union, union_all, case, cast, null,
+    Integer, BigInteger, DateTime, String
+)
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
-from app.models import Message, Chat, Group, User, Chat_Users
+from app.models import MessageKey, Chat, Group, User, Chat_Users, Group_Users
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.schemas import MessageCreate, ChatCreate, GroupCreate, SearchChat, AddUserToGroup
+from app.schemas import MessageCreate, ChatCreate, GroupCreate, SearchChat, AddUserToGroup, MarkRead
+from app.pagination import encode_cursor, encode_sync_cursor, encode_rank_cursor, encode_activity_cursor
+from app.membership import membership, CHAT, GROUP
+from app.metrics import instrument
+from app.serializers import MessageRecord, MESSAGE_TABLES
+from app.tail_cache import tail_cache
+
+INBOX_PREVIEW_LENGTH = int(os.getenv("INBOX_PREVIEW_LENGTH", "200"))
+INBOX_PARTICIPANTS = int(os.getenv("INBOX_PARTICIPANTS", "3"))
+# A message is stamped when its write transaction starts but becomes visible
+# only on commit, so a slow writer can commit behind newer messages. Forward
+# reads stop this far behind the database clock, which must exceed the
+# longest write transaction, so a cursor never passes a message still to come.
+SYNC_COMMIT_LAG = timedelta(seconds=float(os.getenv("SYNC_COMMIT_LAG_SECONDS", "2")))
+# A bound string would be sent as varchar, which no text search function accepts.
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+# ts_headline returns the message text verbatim, so matches are marked with
+# control characters instead of HTML and turned into offsets: a snippet is
+# plain text and never carries markup a client could render.
+HIGHLIGHT_START, HIGHLIGHT_STOP = "\x02", "\x03"
+
+
+# Both stay ValueErrors, so WebSocket handlers answer them with an error frame;
+# the HTTP app maps them to 404 and 403.
+class NotFoundError(ValueError):
+    pass
+
+
+class NotMemberError(ValueError):
+    pass
+
 
+_conversations = {
+    CHAT: (Chat.__table__, Chat_Users, Chat_Users.c.chat_id),
+    GROUP: (Group.__table__, Group_Users, Group_Users.c.group_id),
+}
 
-async def create_message(db: AsyncSession, message_in: MessageCreate) -> Message:
-    query = select(Message).where(
-        Message.chat_id == message_in.chat_id,
-        Message.sender_id == message_in.sender_id,
-        Message.text == message_in.text
+# Chats have no name of their own; clients show the other participant.
+_conversation_names = {
+    CHAT: cast(null(), String),
+    GROUP: Group.__table__.c.name,
+}
+
+
+async def _update_counters(db: AsyncSession, kind: str, inserted: list[MessageRecord]):
+    if not inserted:
+        return
+    conversations, members, member_column = _conversations[kind]
+
+    totals = {}
+    for message in inserted:
+        n, last = totals.get(message.chat_id, (0, message))
+        totals[message.chat_id] = (n + 1, max(last, message, key=lambda record: (record.timestamp, record.id)))
+    counts = values(
+        column("id", Integer), column("n", BigInteger), column("last_id", Integer),
+        column("last_at", DateTime(timezone=True)),
+        name="counts"
+    ).data([(chat_id, n, last.id, last.timestamp) for chat_id, (n, last) in totals.items()])
+    # A concurrent batch may have committed a later message already.
+    newer = (
+        tuple_(counts.c.last_at, counts.c.last_id)
+        > tuple_(conversations.c.last_activity_at, func.coalesce(conversations.c.last_message_id, 0))
+    )
+    await db.execute(
+        update(conversations)
+        .where(conversations.c.id == counts.c.id)
+        .values(
+            message_count=conversations.c.message_count + counts.c.n,
+            last_message_id=case((newer, counts.c.last_id), else_=conversations.c.last_message_id),
+            last_activity_at=case((newer, counts.c.last_at), else_=conversations.c.last_activity_at)
+        )
     )
-    result = await db.execute(query)
-    existing = result.scalar()
-    if existing:
-        return existing
 
-    new_message = Message(
-        chat_id=message_in.chat_id,
-        sender_id=message_in.sender_id,
-        text=message_in.text
+    # A sender has read everything they send.
+    sent = {}
+    for message in inserted:
+        n, max_id = sent.get((message.chat_id, message.sender_id), (0, 0))
+        sent[(message.chat_id, message.sender_id)] = (n + 1, max(max_id, message.id))
+    reads = values(
+        column("conversation_id", Integer), column("user_id", Integer), column("n", BigInteger), column("max_id", Integer),
+        name="reads"
+    ).data([(chat_id, sender_id, n, max_id) for (chat_id, sender_id), (n, max_id) in sent.items()])
+    await db.execute(
+        update(members)
+        .where(member_column == reads.c.conversation_id, members.c.user_id == reads.c.user_id)
+        .values(
+            read_count=members.c.read_count + reads.c.n,
+            last_read_message_id=func.greatest(func.coalesce(members.c.last_read_message_id, 0), reads.c.max_id)
+        )
     )
-    db.add(new_message)
-    try:
-        await db.commit()
-        await db.refresh(new_message)
-    except IntegrityError:
-        await db.rollback()
-        raise
-    return new_message
 
 
-async def get_chat_history(db: AsyncSession, user_id: int, chat_id: int, limit: int = 50, offset: int = 0):
-    query = select(Chat).options(selectinload(Chat.participants)).where(Chat.id == chat_id)
+async def _claim_keys(db: AsyncSession, kind: str, keyed: dict) -> dict:
+    model, _, columns = MESSAGE_TABLES[kind]
+    query = insert(MessageKey).values([
+        dict(
+            kind=kind,
+            conversation_id=record.chat_id,
+            sender_id=record.sender_id,
+            client_msg_id=record.client_msg_id,
+            message_id=record.id,
+            timestamp=record.timestamp
+        )
+        for record in keyed.values()
+    ]).on_conflict_do_nothing().returning(MessageKey.conversation_id, MessageKey.sender_id, MessageKey.client_msg_id)
     result = await db.execute(query)
-    chat = result.scalar()
-    if not chat:
-        raise ValueError("Чат не найден")
-    if not any(u.id == user_id for u in chat.participants):
-        raise ValueError("Пользователь не является участником чата")
+    claimed = {tuple(row) for row in result}
 
-    query = select(Message).where(Message.chat_id == chat_id).order_by(Message.timestamp.asc()).limit(limit).offset(offset)
+    missing = [key for key in keyed if key not in claimed]
+    if not missing:
+        return {}
+    # The key carries the timestamp, so the lookup only touches the partition holding the original.
+    query = (
+        select(*columns)
+        .join(MessageKey, and_(MessageKey.message_id == model.id, MessageKey.timestamp == model.timestamp))
+        .where(
+            MessageKey.kind == kind,
+            tuple_(MessageKey.conversation_id, MessageKey.sender_id, MessageKey.client_msg_id).in_(missing)
+        )
+    )
     result = await db.execute(query)
-    messages = result.scalars().all()
-    return messages
+    return {(row.chat_id, row.sender_id, row.client_msg_id): row for row in result}
+
+
+@instrument
+async def insert_messages(db: AsyncSession, messages_in: list[MessageCreate], kind: str = CHAT) -> list[MessageRecord]:
+    model, conversation_column, _ = MESSAGE_TABLES[kind]
+    sequence = model.__table__.c.id.default
+    result = await db.execute(
+        select(sequence.next_value(), func.now()).select_from(func.generate_series(1, len(messages_in)))
+    )
+    # Ids are allocated up front so a batch keeps its arrival order and
+    # needs no RETURNING to be matched back to its inputs. The timestamp is
+    # the database's clock, the same one last_activity_at starts from, so
+    # the counters' "newer" guard never compares two different clocks.
+    rows = sorted(result.all())
+    ids = [row[0] for row in rows]
+    timestamp = rows[0][1]
+    records = [
+        MessageRecord(
+            message_id, kind, message_in.chat_id, message_in.sender_id, message_in.text,
+            timestamp, False, message_in.client_msg_id
+        )
+        for message_id, message_in in zip(ids, messages_in)
+    ]
 
+    keyed = {}
+    for record in records:
+        if record.client_msg_id is not None:
+            keyed.setdefault((record.chat_id, record.sender_id, record.client_msg_id), record)
+    existing = await _claim_keys(db, kind, keyed) if keyed else {}
 
+    results = []
+    inserted = []
+    for record in records:
+        original = record
+        if record.client_msg_id is not None:
+            key = (record.chat_id, record.sender_id, record.client_msg_id)
+            original = existing.get(key, keyed[key])
+        if original is record:
+            inserted.append(record)
+        results.append(original)
+
+    if inserted:
+        await db.execute(insert(model).values([
+            {
+                "id": record.id,
+                conversation_column.key: record.chat_id,
+                "sender_id": record.sender_id,
+                "text": record.text,
+                "timestamp": record.timestamp,
+                "read": record.read,
+                "client_msg_id": record.client_msg_id
+            }
+            for record in inserted
+        ]))
+        await _update_counters(db, kind, inserted)
+    return results
+
+
+def _settled(model):
+    return model.timestamp < func.now() - SYNC_COMMIT_LAG
+
+
+async def _get_message_page(db: AsyncSession, kind: str, conversation_id: int, limit: int, before=None, after=None):
+    if before is not None and after is not None:
+        raise ValueError("Нельзя указывать before и after одновременно")
+    if limit < 1:
+        return {"messages": [], "next_cursor": None}
+    model, conversation_column, columns = MESSAGE_TABLES[kind]
+    key = tuple_(model.timestamp, model.id)
+    query = select(*columns).where(conversation_column == conversation_id)
+    if after is not None:
+        query = (
+            query.where(key > tuple_(*after), _settled(model))
+            .order_by(model.timestamp.asc(), model.id.asc())
+        )
+    else:
+        if before is not None:
+            query = query.where(key < tuple_(*before))
+        query = query.order_by(model.timestamp.desc(), model.id.desc())
+    result = await db.execute(query.limit(limit + 1))
+    messages = result.all()
+
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        edge = messages[-1]
+        next_cursor = encode_cursor(edge.timestamp, edge.id)
+    if after is None:
+        messages.reverse()
+    return {"messages": messages, "next_cursor": next_cursor}
+
+
+async def _read_messages(db: AsyncSession, kind: str, conversation_id: int, limit: int, before=None, after=None):
+    # Pages after a cursor must stop at the commit horizon, which only the
+    # database can apply, so just backward pages come from the cache.
+    page = None if after is not None else await tail_cache.page(kind, conversation_id, limit, before)
+    if page is None:
+        page = await _get_message_page(db, kind, conversation_id, limit, before, after)
+    return page
+
+
+@instrument
+async def check_chat_member(db: AsyncSession, chat_id: int, user_id: int):
+    if await membership.is_member(db, CHAT, chat_id, user_id):
+        return
+    if await db.get(Chat, chat_id) is None:
+        raise NotFoundError("Чат не найден")
+    raise NotMemberError("Пользователь не является участником чата")
+
+
+@instrument
+async def check_group_member(db: AsyncSession, group_id: int, user_id: int):
+    if await membership.is_member(db, GROUP, group_id, user_id):
+        return
+    if await db.get(Group, group_id) is None:
+        raise NotFoundError("Группа не найдена")
+    raise NotMemberError("Пользователь не является участником группы")
+
+
+@instrument
+async def get_chat_history(db: AsyncSession, user_id: int, chat_id: int, limit: int = 50, before=None, after=None):
+    await check_chat_member(db, chat_id, user_id)
+
+    return await _read_messages(db, CHAT, chat_id, limit, before, after)
+
+
+@instrument
 async def create_group(db: AsyncSession, message_in: GroupCreate) -> Group:
     if message_in.creator_id not in message_in.participant_ids:
         message_in.participant_ids.append(message_in.creator_id)
@@ -66,9 +277,11 @@ async def create_group(db: AsyncSession, message_in: GroupCreate) -> Group:
     except IntegrityError:
         await db.rollback()
         raise
+    membership.add(GROUP, new_group.id, [user.id for user in users])
     return new_group
 
 
+@instrument
 async def create_chat(db: AsyncSession, message_in: ChatCreate) -> Chat:
     query = select(User).where(
         or_(
@@ -92,49 +305,18 @@ async def create_chat(db: AsyncSession, message_in: ChatCreate) -> Chat:
     except IntegrityError:
         await db.rollback()
         raise
-
+    membership.add(CHAT, new_chat.id, [user.id for user in users])
     return new_chat
 
 
-async def get_group_history(db: AsyncSession, user_id: int, group_id: int, limit: int = 50, offset: int = 0):
-    query = select(Group).options(selectinload(Group.participants)).where(Group.id == group_id)
-    result = await db.execute(query)
-    group = result.scalar()
-    if not group:
-        raise ValueError("Группа не найдена")
-    if not any(u.id == user_id for u in group.participants):
-        raise ValueError("Пользователь не является участником группы")
+@instrument
+async def get_group_history(db: AsyncSession, user_id: int, group_id: int, limit: int = 50, before=None, after=None):
+    await check_group_member(db, group_id, user_id)
 
-    query = select(Message).where(Message.chat_id == group_id).order_by(Message.timestamp.asc()).limit(limit).offset(offset)
-    result = await db.execute(query)
-    messages = result.scalars().all()
-    return messages
-
-
-async def send_group_message(db: AsyncSession, message_in: MessageCreate):
-    query = select(Group).options(selectinload(Group.participants)).where(Group.id == message_in.chat_id)
-    result = await db.execute(query)
-    group = result.scalar()
-    if not group:
-        raise ValueError("Группа не найдена")
-    if not any(u.id == message_in.sender_id for u in group.participants):
-        raise ValueError("Пользователь не является участником группы")
-
-    query = select(Group).where(Group.id == message_in.chat_id)
-    result = await db.execute(query)
-    chat = result.scalar()
-    if not chat:
-        raise ValueError("Чат группы не найден")
-
-    message_in = MessageCreate(
-        chat_id=chat.id,
-        sender_id=message_in.sender_id,
-        text=message_in.text
-    )
-    message = await create_message(db, message_in)
-    return message
+    return await _read_messages(db, GROUP, group_id, limit, before, after)
 
 
+@instrument
 async def find_chat_by_name(db: AsyncSession, message_in: SearchChat) -> Chat:
     query = select(User).where(
         or_(
@@ -165,14 +347,9 @@ async def find_chat_by_name(db: AsyncSession, message_in: SearchChat) -> Chat:
     return chat
 
 
+@instrument
 async def add_user_to_group(db: AsyncSession, message_in: AddUserToGroup) -> Group:
-    query = select(Group).options(selectinload(Group.participants)).where(Group.id == message_in.group_id)
-    result = await db.execute(query)
-    group = result.scalar()
-    if not group:
-        raise ValueError("Группа не найдена")
-    if not any(u.id == message_in.user_id for u in group.participants):
-        raise ValueError("Пользователь не является участником группы")
+    await check_group_member(db, message_in.group_id, message_in.user_id)
 
     query = select(User).where(User.email == message_in.email)
     result = await db.execute(query)
@@ -180,14 +357,308 @@ async def add_user_to_group(db: AsyncSession, message_in: AddUserToGroup) -> Gro
     if not user:
         raise ValueError("Пользователь с указанной почтой не найден")
 
-    if any(u.id == user.id for u in group.participants):
+    if await membership.is_member(db, GROUP, message_in.group_id, user.id):
         raise ValueError("Пользователь уже состоит в группе")
 
-    group.participants.append(user)
+    query = insert(Group_Users).values(
+        group_id=message_in.group_id,
+        user_id=user.id,
+        read_count=select(Group.message_count).where(Group.id == message_in.group_id).scalar_subquery()
+    )
     try:
+        await db.execute(query)
         await db.commit()
-        await db.refresh(group)
     except IntegrityError:
         await db.rollback()
         raise
-    return group
\ No newline at end of file
+    membership.add(GROUP, message_in.group_id, [user.id])
+    return await db.get(Group, message_in.group_id)
+
+
+async def _mark_read(db: AsyncSession, kind: str, user_id: int, conversation_id: int, message_id: int):
+    conversations, members, member_column = _conversations[kind]
+    model, conversation_column, _ = MESSAGE_TABLES[kind]
+    marker = (
+        select(model.timestamp)
+        .where(model.id == message_id, conversation_column == conversation_id)
+        .scalar_subquery()
+    )
+    unread_after = (
+        select(func.count())
+        .select_from(model)
+        .where(
+            conversation_column == conversation_id,
+            model.timestamp >= marker,
+            tuple_(model.timestamp, model.id) > tuple_(marker, message_id),
+            model.sender_id != user_id
+        )
+        .scalar_subquery()
+    )
+    query = (
+        update(members)
+        .where(
+            member_column == conversation_id,
+            members.c.user_id == user_id,
+            conversations.c.id == conversation_id,
+            exists().where(model.id == message_id, conversation_column == conversation_id)
+        )
+        .values(
+            last_read_message_id=func.greatest(func.coalesce(members.c.last_read_message_id, 0), message_id),
+            read_count=func.greatest(members.c.read_count, conversations.c.message_count - unread_after)
+        )
+    )
+    await db.execute(query)
+
+
+@instrument
+async def mark_read(db: AsyncSession, user_id: int, message_in: MarkRead):
+    for marker in message_in.chats:
+        await _mark_read(db, CHAT, user_id, marker.id, marker.message_id)
+    for marker in message_in.groups:
+        await _mark_read(db, GROUP, user_id, marker.id, marker.message_id)
+    await db.commit()
+    return await get_unread_counts(db, user_id)
+
+
+@instrument
+async def get_unread_counts(db: AsyncSession, user_id: int):
+    queries = []
+    for kind, (conversations, members, member_column) in _conversations.items():
+        queries.append(
+            select(
+                literal_column(f"'{kind}'").label("kind"),
+                conversations.c.id,
+                (conversations.c.message_count - members.c.read_count).label("unread")
+            )
+            .join_from(members, conversations, conversations.c.id == member_column)
+            .where(members.c.user_id == user_id)
+        )
+    result = await db.execute(union_all(*queries))
+
+    counts = {"chats": [], "groups": [], "total": 0}
+    for kind, conversation_id, unread in result:
+        counts["chats" if kind == CHAT else "groups"].append({"id": conversation_id, "unread": unread})
+        counts["total"] += unread
+    return counts
+
+
+@instrument
+async def get_user_conversations(db: AsyncSession, user_id: int) -> dict[str, list[int]]:
+    result = await db.execute(union_all(*(
+        select(literal_column(f"'{kind}'").label("kind"), member_column.label("id"))
+        .where(members.c.user_id == user_id)
+        for kind, (_, members, member_column) in _conversations.items()
+    )))
+    conversations = {kind: [] for kind in _conversations}
+    for kind, conversation_id in result:
+        conversations[kind].append(conversation_id)
+    for kind, ids in conversations.items():
+        for conversation_id in ids:
+            membership.add(kind, conversation_id, [user_id])
+    return conversations
+
+
+@instrument
+async def get_conversations(db: AsyncSession, user_id: int, limit: int = 50, cursor=None):
+    if limit < 1:
+        return {"conversations": [], "next_cursor": None}
+    branches = []
+    for kind, (conversations, members, member_column) in _conversations.items():
+        model, conversation_column, _ = MESSAGE_TABLES[kind]
+        counted = members.alias()
+        participant_count = (
+            select(func.count())
+            .select_from(counted)
+            .where(counted.c[member_column.key] == conversations.c.id)
+            .scalar_subquery()
+        )
+        kind_column = literal_column(f"'{kind}'")
+        query = (
+            select(
+                kind_column.label("kind"),
+                conversations.c.id,
+                _conversation_names[kind].label("name"),
+                conversations.c.last_activity_at,
+                (conversations.c.message_count - members.c.read_count).label("unread"),
+                participant_count.label("participant_count"),
+                model.id.label("message_id"),
+                model.sender_id,
+                func.substr(model.text, 1, INBOX_PREVIEW_LENGTH).label("text"),
+                model.timestamp
+            )
+            .join_from(members, conversations, conversations.c.id == member_column)
+            # The timestamp pins the preview lookup to a single partition.
+            .outerjoin(model, and_(
+                model.id == conversations.c.last_message_id,
+                model.timestamp == conversations.c.last_activity_at,
+                conversation_column == conversations.c.id
+            ))
+            .where(members.c.user_id == user_id)
+        )
+        if cursor is not None:
+            query = query.where(tuple_(conversations.c.last_activity_at, kind_column, conversations.c.id) < tuple_(*cursor))
+        query = query.order_by(conversations.c.last_activity_at.desc(), conversations.c.id.desc()).limit(limit + 1)
+        branches.append(select(query.subquery()))
+    merged = union_all(*branches).subquery()
+    query = (
+        select(merged)
+        .order_by(merged.c.last_activity_at.desc(), merged.c.kind.desc(), merged.c.id.desc())
+        .limit(limit + 1)
+    )
+    result = await db.execute(query)
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_activity_cursor(rows[-1].last_activity_at, rows[-1].kind, rows[-1].id)
+    participants = await _get_participants(db, user_id, rows) if rows else {}
+    items = [
+        {
+            "kind": row.kind,
+            "id": row.id,
+            "name": row.name,
+            "last_activity_at": row.last_activity_at,
+            "last_message": None if row.message_id is None else {
+                "id": row.message_id,
+                "sender_id": row.sender_id,
+                "text": row.text,
+                "timestamp": row.timestamp
+            },
+            "unread": row.unread,
+            "participant_count": row.participant_count,
+            "participants": participants.get((row.kind, row.id), [])
+        }
+        for row in rows
+    ]
+    return {"conversations": items, "next_cursor": next_cursor}
+
+
+async def _get_participants(db: AsyncSession, user_id: int, rows) -> dict:
+    # The first few other members of every conversation on the page, in one query.
+    ids = {kind: [row.id for row in rows if row.kind == kind] for kind in _conversations}
+    branches = []
+    for kind, (_, members, member_column) in _conversations.items():
+        position = func.row_number().over(partition_by=member_column, order_by=User.id)
+        ranked = (
+            select(member_column.label("conversation_id"), User.id, User.name, position.label("position"))
+            .join(User, User.id == members.c.user_id)
+            .where(member_column.in_(ids[kind]), members.c.user_id != user_id)
+            .subquery()
+        )
+        branches.append(
+            select(literal_column(f"'{kind}'").label("kind"), ranked.c.conversation_id, ranked.c.id, ranked.c.name)
+            .where(ranked.c.position <= INBOX_PARTICIPANTS)
+        )
+    result = await db.execute(union_all(*branches))
+    participants = {}
+    for kind, conversation_id, participant_id, name in result:
+        participants.setdefault((kind, conversation_id), []).append({"id": participant_id, "name": name})
+    return participants
+
+
+@instrument
+async def get_contact_presence(db: AsyncSession, user_id: int):
+    contacts = union(*(
+        select(members.c.user_id).where(
+            member_column.in_(select(member_column).where(members.c.user_id == user_id)),
+            members.c.user_id != user_id
+        )
+        for _, members, member_column in _conversations.values()
+    )).subquery()
+    query = select(User.id, User.name, User.last_seen_at).join(contacts, contacts.c.user_id == User.id)
+    result = await db.execute(query)
+    return result.all()
+
+
+def _member_messages(kind: str, user_id: int):
+    model, conversation_column, columns = MESSAGE_TABLES[kind]
+    _, members, member_column = _conversations[kind]
+    query = (
+        select(*columns)
+        .join(members, member_column == conversation_column)
+        .where(members.c.user_id == user_id)
+    )
+    return model, query
+
+
+@instrument
+async def sync_messages(db: AsyncSession, user_id: int, since=None, limit: int = 500, settled: bool = True):
+    # Chats and groups are separate tables with separate id sequences, so the
+    # cursor keeps a (timestamp, id) position per kind. Unsettled messages
+    # are only for callers that get later commits some other way.
+    positions = dict(since or {})
+    if limit < 1:
+        return {"messages": [], "next_cursor": encode_sync_cursor(positions) if positions else None, "has_more": False}
+    branches = []
+    for kind in MESSAGE_TABLES:
+        model, query = _member_messages(kind, user_id)
+        if kind in positions:
+            query = query.where(tuple_(model.timestamp, model.id) > tuple_(*positions[kind]))
+        if settled:
+            query = query.where(_settled(model))
+        query = query.order_by(model.timestamp.asc(), model.id.asc()).limit(limit + 1)
+        branches.append(select(query.subquery()))
+    merged = union_all(*branches).subquery()
+    query = (
+        select(merged)
+        .order_by(merged.c.timestamp.asc(), merged.c.kind.asc(), merged.c.id.asc())
+        .limit(limit + 1)
+    )
+    result = await db.execute(query)
+    messages = result.all()
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    for message in messages:
+        positions[message.kind] = (message.timestamp, message.id)
+    next_cursor = encode_sync_cursor(positions) if positions else None
+    return {"messages": messages, "next_cursor": next_cursor, "has_more": has_more}
+
+
+@instrument
+async def search_messages(db: AsyncSession, user_id: int, text: str, limit: int = 20, cursor=None):
+    if limit < 1:
+        return {"hits": [], "next_cursor": None}
+    tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+    branches = []
+    for kind in MESSAGE_TABLES:
+        model, query = _member_messages(kind, user_id)
+        rank = func.ts_rank_cd(model.search_vector, tsquery)
+        branches.append(query.add_columns(rank.label("rank")).where(model.search_vector.op("@@")(tsquery)))
+    matches = union_all(*branches).subquery()
+    # Headlines are computed in the outer query so only returned rows pay for them.
+    snippet = func.ts_headline(
+        SEARCH_CONFIG,
+        func.translate(matches.c.text, HIGHLIGHT_START + HIGHLIGHT_STOP, ""),
+        tsquery,
+        f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxFragments=2"
+    )
+
+    query = select(matches, snippet.label("snippet"))
+    if cursor is not None:
+        query = query.where(tuple_(matches.c.rank, matches.c.kind, matches.c.id) < tuple_(*cursor))
+    query = query.order_by(matches.c.rank.desc(), matches.c.kind.desc(), matches.c.id.desc()).limit(limit + 1)
+    result = await db.execute(query)
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].kind, rows[-1].id)
+    hits = [{"message": row, "rank": row.rank, **_split_headline(row.snippet)} for row in rows]
+    return {"hits": hits, "next_cursor": next_cursor}
+
+
+def _split_headline(headline: str) -> dict:
+    snippet = []
+    highlights = []
+    length = 0
+    for index, part in enumerate(headline.split(HIGHLIGHT_START)):
+        matched, _, rest = part.partition(HIGHLIGHT_STOP) if index else ("", "", part)
+        if matched:
+            highlights.append((length, length + len(matched)))
+            length += len(matched)
+        snippet += [matched, rest]
+        length += len(rest)
+    return {"snippet": "".join(snippet), "highlights": highlights}
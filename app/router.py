@@ -1,19 +1,34 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+import logging
+import math
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from app.database import get_db
+from app.database import get_db, get_replica_db, async_session, async_replica_session, pool_stats
 from app.models import User
 from app.schemas import (
     MessageCreate,
     MessageResponse,
+    MessagePage,
+    SyncPage,
+    MessageSearchPage,
     ChatCreate,
     ChatResponse,
     GroupCreate,
     GroupResponse,
     SearchChat,
     AddUserToGroup,
+    MarkRead,
+    SendFrame,
+    SubscriptionFrame,
+    UnreadCounts,
+    ConversationPage,
+    Presence,
     Token,
     UserCreate,
     UserResponse
@@ -23,35 +38,70 @@ from app.repository import (
     create_group,
     create_chat,
     get_group_history,
-    send_group_message,
     find_chat_by_name,
     add_user_to_group,
-    create_message
+    mark_read,
+    get_unread_counts,
+    sync_messages,
+    check_chat_member,
+    check_group_member,
+    search_messages,
+    get_contact_presence,
+    get_conversations,
+    get_user_conversations
 )
-from app.websocket_manager import manager
+from app.websocket_manager import Connection, manager
+from app.presence import presence
+from app.ingest import ingest, IngestError
+from app.membership import CHAT, GROUP
+from app.pagination import decode_cursor, decode_sync_cursor, decode_rank_cursor, decode_activity_cursor
+from app.export import export_messages, MEDIA_TYPES, NDJSON
+from app.serializers import message_payload, message_page
+from app.ratelimit import send_limiter, limit_auth
 from app.auth import (
-    create_access_token, authenticate_user, get_current_user,
-    get_password_hash
+    CurrentUser, create_access_token, authenticate_user, get_current_user,
+    password_hasher, user_cache
 )
 
 
-router = APIRouter(prefix="/chat", tags=["Chat"])
+router = APIRouter(prefix="/chat", tags=["Chat"], default_response_class=ORJSONResponse)
+logger = logging.getLogger(__name__)
+
+HISTORY_MAX_LIMIT = 200
+SYNC_MAX_LIMIT = 500
+SEARCH_MAX_LIMIT = 100
+CONVERSATIONS_MAX_LIMIT = 100
+
+
+def parse_cursor(cursor: Optional[str], decode=decode_cursor):
+    try:
+        return decode(cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
 
-@router.post("/register", response_model=UserResponse)
+def history_cursors(before: Optional[str], after: Optional[str]):
+    if before is not None and after is not None:
+        raise HTTPException(status_code=400, detail="Нельзя указывать before и after одновременно")
+    return parse_cursor(before), parse_cursor(after)
+
+
+@router.post("/register", response_model=UserResponse, dependencies=[Depends(limit_auth)])
 async def register(user: UserCreate, db: AsyncSession = Depends(get_db)):
     query = select(User).where(User.email == user.email)
     result = await db.execute(query)
     existing_user = result.scalar_one_or_none()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     new_user = User(name=user.username, email=user.email, password=hashed_password)
     db.add(new_user)
     await db.commit()
     await db.refresh(new_user)
+    user_cache.invalidate(new_user.name)
     return new_user
 
-@router.post("/token", response_model=Token)
+@router.post("/token", response_model=Token, dependencies=[Depends(limit_auth)])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
@@ -60,26 +110,27 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.name})
+    access_token = create_access_token(data={"sub": user.name, "uid": user.id})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@router.get("/history/{chat_id}", response_model=list[MessageResponse])
+@router.get("/history/{chat_id}", response_model=MessagePage)
 async def history(
     chat_id: int,
-    limit: int = 50,
-    offset: int = 0,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(50, ge=1, le=HISTORY_MAX_LIMIT),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_replica_db),
+    current_user: CurrentUser = Depends(get_current_user)
     ):
-    messages = await get_chat_history(db, current_user.id, chat_id, limit, offset)
-    return messages
+    page = await get_chat_history(db, current_user.id, chat_id, limit, *history_cursors(before, after))
+    return ORJSONResponse(message_page(page))
 
 
 @router.post("/chat", response_model=ChatResponse)
 async def post_chat(
     user: ChatCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
     ):
     if user.creator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Неверный идентификатор пользователя")
@@ -91,40 +142,46 @@ async def post_chat(
 async def post_group(
     user: GroupCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
     ):
     if user.creator_id != current_user.id:
         raise HTTPException(status_code=403, detail="Неверный идентификатор пользователя")
     group = await create_group(db, user)
     return group
 
-@router.get("/group-history/{group_id}", response_model=list[MessageResponse])
+@router.get("/group-history/{group_id}", response_model=MessagePage)
 async def group_history(
     group_id: int,
-    limit: int = 50,
-    offset: int = 0,
-    db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(50, ge=1, le=HISTORY_MAX_LIMIT),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    db: AsyncSession = Depends(get_replica_db),
+    current_user: CurrentUser = Depends(get_current_user)
     ):
-    messages = await get_group_history(db, current_user.id, group_id, limit, offset)
-    return messages
+    page = await get_group_history(db, current_user.id, group_id, limit, *history_cursors(before, after))
+    return ORJSONResponse(message_page(page))
 
 @router.post("/group-message", response_model=MessageResponse)
 async def post_group_message(
     user: MessageCreate,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
     ):
     if user.sender_id != current_user.id:
         raise HTTPException(status_code=403, detail="Неверный идентификатор отправителя")
-    message = await send_group_message(db, user)
-    return message
+    await send_limiter.enforce(current_user.id)
+    await check_group_member(db, user.chat_id, user.sender_id)
+    try:
+        return await ingest.submit(user, GROUP)
+    except IngestError as exc:
+        headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after is not None else None
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(exc), headers=headers)
 
 @router.post("/find-chat", response_model=ChatResponse)
 async def post_find_chat(
     user: SearchChat,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
     ):
     chat = await find_chat_by_name(db, user)
     if not chat:
@@ -135,44 +192,327 @@ async def post_find_chat(
 async def post_add_user_to_group(
     user: AddUserToGroup,
     db: AsyncSession = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
     ):
     group = await add_user_to_group(db, user)
     return group
 
 
-@router.websocket("/ws/{chat_id}")
-async def websocket_endpoint(websocket: WebSocket, chat_id: int, db: AsyncSession = Depends(get_db)):
+@router.post("/read", response_model=UnreadCounts)
+async def post_read(
+    markers: MarkRead,
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    counts = await mark_read(db, current_user.id, markers)
+    return counts
+
+@router.get("/unread", response_model=UnreadCounts)
+async def unread(
+    db: AsyncSession = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    counts = await get_unread_counts(db, current_user.id)
+    return counts
+
+
+@router.get("/conversations", response_model=ConversationPage)
+async def conversations(
+    limit: int = Query(50, ge=1, le=CONVERSATIONS_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_replica_db),
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    page = await get_conversations(
+        db, current_user.id, limit, parse_cursor(cursor, decode_activity_cursor)
+    )
+    return ORJSONResponse(page)
+
+
+@router.get("/sync", response_model=SyncPage)
+async def sync(
+    since: Optional[str] = None,
+    limit: int = Query(SYNC_MAX_LIMIT, ge=1, le=SYNC_MAX_LIMIT),
+    db: AsyncSession = Depends(get_replica_db),
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    page = await sync_messages(
+        db, current_user.id, parse_cursor(since, decode_sync_cursor), limit
+    )
+    return ORJSONResponse(message_page(page))
+
+
+def export_response(kind: str, conversation_id: int, fmt: str, since: Optional[datetime], until: Optional[datetime]):
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Неподдерживаемый формат")
+    return StreamingResponse(
+        export_messages(kind, conversation_id, fmt, since, until),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{kind}-{conversation_id}.{fmt}"'}
+    )
+
+@router.get("/export/{chat_id}")
+async def export_chat(
+    chat_id: int,
+    format: str = NDJSON,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    # A request-scoped session would stay open until the download finishes.
+    async with async_replica_session() as db:
+        await check_chat_member(db, chat_id, current_user.id)
+    return export_response(CHAT, chat_id, format, since, until)
+
+@router.get("/group-export/{group_id}")
+async def export_group(
+    group_id: int,
+    format: str = NDJSON,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    # A request-scoped session would stay open until the download finishes.
+    async with async_replica_session() as db:
+        await check_group_member(db, group_id, current_user.id)
+    return export_response(GROUP, group_id, format, since, until)
+
+
+@router.get("/search", response_model=MessageSearchPage)
+async def search(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_replica_db),
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    page = await search_messages(
+        db, current_user.id, q, limit, parse_cursor(cursor, decode_rank_cursor)
+    )
+    hits = [{**hit, "message": message_payload(hit["message"])} for hit in page["hits"]]
+    return ORJSONResponse({"hits": hits, "next_cursor": page["next_cursor"]})
+
+
+@router.get("/presence", response_model=List[Presence])
+async def get_presence(
+    db: AsyncSession = Depends(get_replica_db),
+    current_user: CurrentUser = Depends(get_current_user)
+    ):
+    contacts = await get_contact_presence(db, current_user.id)
+    return [
+        {**presence.status(contact.id, contact.last_seen_at), "name": contact.name}
+        for contact in contacts
+    ]
+
+
+@router.get("/pool-stats")
+async def get_pool_stats(current_user: CurrentUser = Depends(get_current_user)):
+    return pool_stats()
+
+
+_member_checks = {CHAT: check_chat_member, GROUP: check_group_member}
+
+
+# Sockets hold no database session: each step that needs the database
+# borrows a short-lived one, and messages are written by the ingest stage.
+async def authenticate_websocket(websocket: WebSocket) -> Optional[CurrentUser]:
     token = websocket.query_params.get("token")
     if token is None:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Missing token")
+        return None
+    async with async_session() as db:
+        try:
+            return await get_current_user(token, db)
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token")
+            return None
+
+
+async def check_member(kind: str, conversation_id: int, user_id: int):
+    async with async_session() as db:
+        await _member_checks[kind](db, conversation_id, user_id)
+
+
+@router.websocket("/ws")
+async def multiplexed_websocket_endpoint(websocket: WebSocket):
+    current_user = await authenticate_websocket(websocket)
+    if current_user is None:
+        return
+    async with async_session() as db:
+        conversations = await get_user_conversations(db, current_user.id)
+
+    connection = await manager.connect(websocket, current_user.id)
+    presence.connected(current_user.id)
+    try:
+        for kind, conversation_ids in conversations.items():
+            for conversation_id in conversation_ids:
+                await manager.subscribe(connection, kind, conversation_id)
+        since = websocket.query_params.get("since")
+        if since is not None:
+            await resume(connection, current_user.id, since)
+        while True:
+            frame = await manager.receive(connection)
+            await handle_frame(connection, current_user, frame)
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        logger.exception("WebSocket connection of user %s failed", current_user.id)
+    finally:
+        presence.disconnected(current_user.id)
+        manager.disconnect(connection)
+
+
+async def handle_frame(connection: Connection, current_user: CurrentUser, frame):
+    if not isinstance(frame, dict):
+        await send_error(connection, None, "Frame must be a JSON object")
+        return
+    frame_type = frame.get("type")
+    if frame_type == "pong":
+        return
+    if frame_type == "ping":
+        await manager.send(connection, {"type": "pong"})
+        return
+
+    ref = frame.get("ref")
+    handler = _frame_handlers.get(frame_type)
+    if handler is None:
+        await send_error(connection, ref, "Unknown frame type")
+        return
+    try:
+        await handler(connection, current_user, frame)
+    except IngestError as exc:
+        await send_error(connection, ref, str(exc), exc.retry_after)
+    except ValueError as exc:
+        await send_error(connection, ref, str(exc))
+
+
+async def send_error(connection: Connection, ref, error: str, retry_after: Optional[float] = None):
+    frame = {"type": "error", "ref": ref, "error": error}
+    if retry_after is not None:
+        frame["retry_after"] = retry_after
+    await manager.send(connection, frame)
+
+
+async def handle_send(connection: Connection, current_user: CurrentUser, frame: dict):
+    send = SendFrame(**frame)
+    await check_member(send.kind, send.chat_id, current_user.id)
+    retry_after = await send_limiter.check(current_user.id)
+    if retry_after:
+        await send_error(connection, send.ref, "Rate limit exceeded", retry_after)
         return
+    message_in = MessageCreate(
+        chat_id=send.chat_id, sender_id=current_user.id, text=send.text, client_msg_id=send.client_msg_id
+    )
+    message = await ingest.submit(message_in, send.kind)
+    await manager.send(connection, {"type": "ack", "ref": send.ref, "message": message_payload(message)})
 
+
+def subscription_ack(subscription: SubscriptionFrame) -> dict:
+    return {"type": "ack", "ref": subscription.ref, "kind": subscription.kind, "id": subscription.id}
+
+
+async def handle_subscribe(connection: Connection, current_user: CurrentUser, frame: dict):
+    subscription = SubscriptionFrame(**frame)
+    await check_member(subscription.kind, subscription.id, current_user.id)
+    await manager.subscribe(connection, subscription.kind, subscription.id)
+    await manager.send(connection, subscription_ack(subscription))
+
+
+async def handle_unsubscribe(connection: Connection, current_user: CurrentUser, frame: dict):
+    subscription = SubscriptionFrame(**frame)
+    manager.unsubscribe(connection, subscription.kind, subscription.id)
+    await manager.send(connection, subscription_ack(subscription))
+
+_frame_handlers = {
+    "send": handle_send,
+    "subscribe": handle_subscribe,
+    "unsubscribe": handle_unsubscribe,
+}
+
+
+@router.websocket("/ws/{chat_id}")
+async def websocket_endpoint(websocket: WebSocket, chat_id: int):
+    current_user = await authenticate_websocket(websocket)
+    if current_user is None:
+        return
     try:
-        current_user = await get_current_user(token, db)
-    except HTTPException as exc:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid token")
+        await check_member(CHAT, chat_id, current_user.id)
+    except ValueError as exc:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(exc))
         return
 
-    await manager.connect(chat_id, websocket)
+    connection = await manager.connect(websocket, current_user.id)
+    presence.connected(current_user.id)
     try:
+        await manager.subscribe(connection, CHAT, chat_id)
+        since = websocket.query_params.get("since")
+        if since is not None:
+            await resume(connection, current_user.id, since)
         while True:
-            data = await websocket.receive_json()
+            data = await manager.receive(connection)
+            if not isinstance(data, dict):
+                await manager.send(connection, {"error": "Frame must be a JSON object"})
+                continue
+            if data.get("type") == "pong":
+                continue
+            if data.get("type") == "ping":
+                await manager.send(connection, {"type": "pong"})
+                continue
+            retry_after = 0.0
+            if data.get("sender_id") == current_user.id:
+                retry_after = await send_limiter.check(current_user.id)
+            if retry_after:
+                await manager.send(connection, {"error": "Rate limit exceeded", "retry_after": retry_after})
+                continue
             if data.get("sender_id") != current_user.id:
-                await websocket.send_json({"error": "Unauthorized sender"})
+                await manager.send(connection, {"error": "Unauthorized sender"})
+                continue
+            # The socket is bound to one chat; a frame cannot write elsewhere.
+            try:
+                message_in = MessageCreate(**{**data, "chat_id": chat_id})
+            except ValueError as exc:
+                await manager.send(connection, {"error": str(exc)})
+                continue
+            try:
+                await ingest.submit(message_in, CHAT)
+            except IngestError as exc:
+                error = {"error": str(exc)}
+                if exc.retry_after is not None:
+                    error["retry_after"] = exc.retry_after
+                await manager.send(connection, error)
                 continue
-            message_in = MessageCreate(**data)
-            message = await create_message(db, message_in)
-            response = {
-                "id": message.id,
-                "chat_id": message.chat_id,
-                "sender_id": message.sender_id,
-                "text": message.text,
-                "timestamp": message.timestamp.isoformat(),
-                "read": message.read
-            }
-            await manager.broadcast(chat_id, response)
     except WebSocketDisconnect:
-        manager.disconnect(chat_id, websocket)
-    except Exception as e:
-        print(f"WebSocket closed before error could be sent: {e}")
\ No newline at end of file
+        pass
+    except Exception:
+        logger.exception("WebSocket connection to chat %s failed", chat_id)
+    finally:
+        presence.disconnected(current_user.id)
+        manager.disconnect(connection)
+
+
+async def resume(connection: Connection, user_id: int, since: str):
+    try:
+        cursor = decode_sync_cursor(since)
+    except ValueError as exc:
+        await manager.send(connection, {"type": "error", "error": str(exc)})
+        return
+    while True:
+        # The session is released before the page is queued, so a slow client
+        # never keeps a connection checked out.
+        async with async_replica_session() as db:
+            page = await sync_messages(db, user_id, cursor, SYNC_MAX_LIMIT)
+        await manager.send(connection, {"type": "sync", **message_page(page)})
+        if not page["has_more"]:
+            break
+        cursor = decode_sync_cursor(page["next_cursor"])
+    if page["next_cursor"] is None:
+        return
+    # The socket is already subscribed, so anything committing from now on is
+    # delivered live. Messages newer than the commit horizon are sent too,
+    # but the cursor stays at the horizon for the next sync.
+    async with async_session() as db:
+        recent = await sync_messages(db, user_id, decode_sync_cursor(page["next_cursor"]), SYNC_MAX_LIMIT, settled=False)
+    if recent["messages"]:
+        await manager.send(connection, {
+            "type": "sync", **message_page(recent), "next_cursor": page["next_cursor"], "has_more": False
+        })
@@ -1,24 +1,73 @@
-from pydantic import BaseModel
-from typing import Optional, List
+import os
+from pydantic import BaseModel, Field, validator
+from typing import Literal, Optional, List, Tuple
 from datetime import datetime
 
+MESSAGE_MAX_LENGTH = int(os.getenv("MESSAGE_MAX_LENGTH", "4000"))
+CLIENT_MSG_ID_MAX_LENGTH = 64
+
+
+# PostgreSQL text cannot hold NUL; letting one through fails the whole write.
+def reject_nul(value: Optional[str]) -> Optional[str]:
+    if value is not None and "\x00" in value:
+        raise ValueError("NUL characters are not allowed")
+    return value
+
 
 class MessageCreate(BaseModel):
     chat_id: int
     sender_id: int
-    text: str
+    text: str = Field(..., max_length=MESSAGE_MAX_LENGTH)
+    client_msg_id: Optional[str] = Field(None, max_length=CLIENT_MSG_ID_MAX_LENGTH)
+
+    _no_nul = validator("text", "client_msg_id", allow_reuse=True)(reject_nul)
 
 class MessageResponse(BaseModel):
     id: int
+    kind: str = "chat"
     chat_id: int
     sender_id: int
     text: str
     timestamp: datetime
     read: bool
+    client_msg_id: Optional[str] = None
 
     class Config:
         orm_mode = True
 
+class MessagePage(BaseModel):
+    messages: List[MessageResponse]
+    next_cursor: Optional[str] = None
+
+class SyncPage(BaseModel):
+    messages: List[MessageResponse]
+    next_cursor: Optional[str] = None
+    has_more: bool
+
+class MessageSearchHit(BaseModel):
+    message: MessageResponse
+    rank: float
+    snippet: str
+    highlights: List[Tuple[int, int]]
+
+class MessageSearchPage(BaseModel):
+    hits: List[MessageSearchHit]
+    next_cursor: Optional[str] = None
+
+class SendFrame(BaseModel):
+    kind: Literal["chat", "group"]
+    chat_id: int
+    text: str = Field(..., max_length=MESSAGE_MAX_LENGTH)
+    client_msg_id: Optional[str] = Field(None, max_length=CLIENT_MSG_ID_MAX_LENGTH)
+    ref: Optional[str] = None
+
+    _no_nul = validator("text", "client_msg_id", allow_reuse=True)(reject_nul)
+
+class SubscriptionFrame(BaseModel):
+    kind: Literal["chat", "group"]
+    id: int
+    ref: Optional[str] = None
+
 class ChatCreate(BaseModel):
     creator_id: int
     second_email: str
@@ -71,4 +120,51 @@ class SearchChat(BaseModel):
 class AddUserToGroup(BaseModel):
     user_id: int
     group_id: int
-    email: str
\ No newline at end of file
+    email: str
+
+class ReadMarker(BaseModel):
+    id: int
+    message_id: int
+
+class MarkRead(BaseModel):
+    chats: List[ReadMarker] = []
+    groups: List[ReadMarker] = []
+
+class UnreadCount(BaseModel):
+    id: int
+    unread: int
+
+class Presence(BaseModel):
+    user_id: int
+    name: str
+    online: bool
+    last_seen_at: Optional[datetime] = None
+
+class ConversationParticipant(BaseModel):
+    id: int
+    name: str
+
+class LastMessage(BaseModel):
+    id: int
+    sender_id: int
+    text: str
+    timestamp: datetime
+
+class Conversation(BaseModel):
+    kind: str
+    id: int
+    name: Optional[str] = None
+    last_activity_at: datetime
+    last_message: Optional[LastMessage] = None
+    unread: int
+    participant_count: int
+    participants: List[ConversationParticipant]
+
+class ConversationPage(BaseModel):
+    conversations: List[Conversation]
+    next_cursor: Optional[str] = None
+
+class UnreadCounts(BaseModel):
+    chats: List[UnreadCount]
+    groups: List[UnreadCount]
+    total: int
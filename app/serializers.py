@@ -0,0 +1,68 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import orjson
+from sqlalchemy import literal_column
+
+from app.membership import CHAT, GROUP
+from app.models import Message, GroupMessage
+
+
+class MessageRecord(NamedTuple):
+    id: int
+    kind: str
+    chat_id: int
+    sender_id: int
+    text: str
+    timestamp: datetime
+    read: bool
+    client_msg_id: Optional[str]
+
+
+def message_columns(kind: str, conversation_column) -> list:
+    # Chat and group rows share one shape: the conversation id is always
+    # exposed as chat_id and `kind` tells which table it came from.
+    model = conversation_column.class_
+    return [
+        model.id,
+        literal_column(f"'{kind}'").label("kind"),
+        conversation_column.label("chat_id"),
+        model.sender_id,
+        model.text,
+        model.timestamp,
+        model.read,
+        model.client_msg_id,
+    ]
+
+MESSAGE_COLUMNS = message_columns(CHAT, Message.chat_id)
+GROUP_MESSAGE_COLUMNS = message_columns(GROUP, GroupMessage.group_id)
+
+MESSAGE_TABLES = {
+    CHAT: (Message, Message.chat_id, MESSAGE_COLUMNS),
+    GROUP: (GroupMessage, GroupMessage.group_id, GROUP_MESSAGE_COLUMNS),
+}
+
+
+def dumps(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+
+def message_payload(message) -> dict:
+    return {
+        "id": message.id,
+        "kind": message.kind,
+        "chat_id": message.chat_id,
+        "sender_id": message.sender_id,
+        "text": message.text,
+        "timestamp": message.timestamp,
+        "read": message.read,
+        "client_msg_id": message.client_msg_id
+    }
+
+
+def message_event(message) -> dict:
+    return {"type": "message", **message_payload(message)}
+
+
+def message_page(page: dict) -> dict:
+    return {**page, "messages": [message_payload(message) for message in page["messages"]]}
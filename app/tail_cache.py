@@ -0,0 +1,198 @@
+import bisect
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional
+
+import orjson
+from sqlalchemy.future import select
+
+from app.database import async_session
+from app.metrics import TAIL_CACHE_LOOKUPS, TAIL_CACHE_BYTES
+from app.pagination import encode_cursor
+from app.serializers import MessageRecord, MESSAGE_TABLES
+
+TAIL_CACHE_SIZE = int(os.getenv("TAIL_CACHE_SIZE", "200"))
+TAIL_CACHE_BUDGET_MB = float(os.getenv("TAIL_CACHE_BUDGET_MB", "64"))
+# Rough cost of one record tuple and its boxed fields, on top of its text.
+RECORD_OVERHEAD = 320
+
+logger = logging.getLogger(__name__)
+
+ConversationKey = tuple[str, int]
+
+
+def _position(record: MessageRecord) -> tuple[datetime, int]:
+    return record.timestamp, record.id
+
+
+def _cost(record: MessageRecord) -> int:
+    return RECORD_OVERHEAD + len(record.text)
+
+
+class TailRing:
+    # The newest messages of one conversation, ordered by (timestamp, id).
+    # Until the seed query lands the ring only buffers deliveries; it is
+    # never trimmed then, so nothing between the seed and the buffer is lost.
+    __slots__ = ("records", "size", "complete", "exhaustive")
+
+    def __init__(self):
+        self.records: list[MessageRecord] = []
+        self.size = 0
+        self.complete = False
+        # Set when the ring holds every message of the conversation.
+        self.exhaustive = False
+
+    def add(self, record: MessageRecord, capacity: int) -> int:
+        records = self.records
+        index = bisect.bisect_left(records, _position(record), key=_position)
+        if index < len(records) and records[index].id == record.id:
+            return 0
+        records.insert(index, record)
+        self.size += _cost(record)
+        return _cost(record) + self._trim(capacity)
+
+    def fill(self, seed: list[MessageRecord], exhaustive: bool, capacity: int) -> int:
+        self.complete = True
+        self.exhaustive = exhaustive
+        # Deliveries buffered during the seed may already overflow the ring.
+        added = self._trim(capacity)
+        for record in seed:
+            added += self.add(record, capacity)
+        return added
+
+    def _trim(self, capacity: int) -> int:
+        excess = len(self.records) - capacity
+        if not self.complete or excess <= 0:
+            return 0
+        freed = sum(_cost(record) for record in self.records[:excess])
+        del self.records[:excess]
+        self.size -= freed
+        self.exhaustive = False
+        return -freed
+
+    def page(self, limit: int, before=None) -> Optional[dict]:
+        records = self.records
+        end = len(records) if before is None else bisect.bisect_left(records, before, key=_position)
+        messages = records[max(0, end - limit - 1):end]
+        if len(messages) <= limit:
+            if not self.exhaustive:
+                return None
+            return {"messages": messages, "next_cursor": None}
+        messages = messages[1:]
+        edge = messages[0]
+        return {"messages": messages, "next_cursor": encode_cursor(edge.timestamp, edge.id)}
+
+
+class TailCache:
+    # Rings are kept only for conversations whose broker channel this process
+    # listens on: every message is published in the transaction that writes
+    # it, so deliveries keep the ring complete no matter which process wrote
+    # it. Other conversations always read from the database, and so does
+    # everything when the broker does not reach every process.
+    def __init__(self, capacity: int = TAIL_CACHE_SIZE, budget_mb: float = TAIL_CACHE_BUDGET_MB):
+        self.capacity = capacity
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.enabled = True
+        self.live: set[ConversationKey] = set()
+        self.rings: OrderedDict[ConversationKey, TailRing] = OrderedDict()
+        self.size = 0
+        self.hits = TAIL_CACHE_LOOKUPS.labels("hit")
+        self.misses = TAIL_CACHE_LOOKUPS.labels("miss")
+
+    def track(self, kind: str, conversation_id: int):
+        if self.enabled:
+            self.live.add((kind, conversation_id))
+
+    def untrack(self, kind: str, conversation_id: int):
+        key = (kind, conversation_id)
+        self.live.discard(key)
+        self._discard(key)
+
+    def clear(self):
+        self.rings.clear()
+        self._resize(-self.size)
+
+    def add(self, records: Iterable[MessageRecord]):
+        for record in records:
+            ring = self.rings.get((record.kind, record.chat_id))
+            if ring is not None:
+                self._resize(ring.add(record, self.capacity))
+        self._shrink()
+
+    def add_payload(self, kind: str, conversation_id: int, payload: str):
+        if (kind, conversation_id) not in self.rings:
+            return
+        event = orjson.loads(payload)
+        if event.get("type") != "message":
+            return
+        self.add([MessageRecord(
+            event["id"], kind, conversation_id, event["sender_id"], event["text"],
+            datetime.fromisoformat(event["timestamp"]), event["read"], event["client_msg_id"]
+        )])
+
+    async def page(self, kind: str, conversation_id: int, limit: int, before=None) -> Optional[dict]:
+        key = (kind, conversation_id)
+        if (
+            key not in self.live
+            or not 0 < limit <= self.capacity
+            or (before is not None and before[0].tzinfo is None)
+        ):
+            return None
+        ring = self.rings.get(key)
+        if ring is None:
+            ring = await self._seed(key)
+        page = ring.page(limit, before) if ring is not None and ring.complete else None
+        if page is None:
+            self.misses.inc()
+            return None
+        self.rings.move_to_end(key)
+        self.hits.inc()
+        return page
+
+    async def _seed(self, key: ConversationKey) -> Optional[TailRing]:
+        # Registered before the query so deliveries landing meanwhile are
+        # kept. The seed reads the primary: a lagging replica could miss
+        # messages whose deliveries arrived before the ring existed.
+        ring = self.rings[key] = TailRing()
+        kind, conversation_id = key
+        model, conversation_column, columns = MESSAGE_TABLES[kind]
+        query = (
+            select(*columns)
+            .where(conversation_column == conversation_id)
+            .order_by(model.timestamp.desc(), model.id.desc())
+            .limit(self.capacity + 1)
+        )
+        try:
+            async with async_session() as db:
+                result = await db.execute(query)
+                rows = result.all()
+        except Exception:
+            logger.exception("Failed to load the tail of %s %s", kind, conversation_id)
+            self._discard(key, ring)
+            return None
+        if self.rings.get(key) is not ring:
+            # Untracked or cleared while the query ran.
+            return None
+        seed = [MessageRecord(*row) for row in rows[:self.capacity]]
+        self._resize(ring.fill(seed, len(rows) <= self.capacity, self.capacity))
+        self._shrink()
+        return ring
+
+    def _discard(self, key: ConversationKey, ring: Optional[TailRing] = None):
+        if ring is None or self.rings.get(key) is ring:
+            ring = self.rings.pop(key, None)
+            if ring is not None:
+                self._resize(-ring.size)
+
+    def _shrink(self):
+        while self.size > self.budget and len(self.rings) > 1:
+            _, ring = self.rings.popitem(last=False)
+            self._resize(-ring.size)
+
+    def _resize(self, delta: int):
+        self.size += delta
+        TAIL_CACHE_BYTES.set(self.size)
+
+tail_cache = TailCache()
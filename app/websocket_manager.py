@@ -1,25 +1,230 @@
-from typing import List
-from fastapi import WebSocket
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from fastapi import WebSocket, WebSocketDisconnect, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.broker import Broker, create_broker
+from app.metrics import (
+    WS_CONNECTIONS, WS_CONNECTIONS_REAPED, WS_SUBSCRIPTIONS, BROADCAST_FANOUT, BROADCAST_SECONDS, BROADCAST_PUBLISH_ERRORS
+)
+from app.protocols import Frame, Protocol, json_protocol, negotiate
+from app.ratelimit import RateLimiter, frame_limiter
+from app.tail_cache import tail_cache
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", DROP_OLDEST)
+CLOSE_TIMEOUT = 5
+
+logger = logging.getLogger(__name__)
+
+# A conversation is addressed by (kind, id): chat 5 and group 5 are different.
+ConversationKey = tuple[str, int]
+
+
+class Connection:
+    def __init__(
+        self, websocket: WebSocket, queue_size: int, user_id: Optional[int] = None, protocol: Protocol = json_protocol
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.protocol = protocol
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: asyncio.Task = None
+        self.subscriptions: set[ConversationKey] = set()
+        # Set while frames are being refused, so a flood gets a single reply.
+        self.throttled = False
+
+    def enqueue(self, payload: Frame, policy: str) -> bool:
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            if policy == DISCONNECT:
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(payload)
+            return True
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, List[WebSocket]] = {}
-
-    async def connect(self, chat_id: int, websocket: WebSocket):
-        await websocket.accept()
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = []
-        self.active_connections[chat_id].append(websocket)
-
-    def disconnect(self, chat_id: int, websocket: WebSocket):
-        if chat_id in self.active_connections:
-            self.active_connections[chat_id].remove(websocket)
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-
-    async def broadcast(self, chat_id: int, message: dict):
-        if chat_id in self.active_connections:
-            for connection in self.active_connections[chat_id]:
-                await connection.send_json(message)
-
-manager = ConnectionManager()
\ No newline at end of file
+    def __init__(
+        self,
+        broker: Broker = None,
+        queue_size: int = SEND_QUEUE_SIZE,
+        overflow_policy: str = OVERFLOW_POLICY,
+        limiter: RateLimiter = frame_limiter
+    ):
+        if overflow_policy not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.broker = broker or create_broker()
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.limiter = limiter
+        self.connections: set[Connection] = set()
+        self.subscribers: dict[ConversationKey, set[Connection]] = {}
+
+    async def start(self):
+        # A process only sees the writes of others through a shared broker;
+        # without one a cached tail could silently miss messages.
+        tail_cache.enabled = self.broker.shared
+        await self.broker.start(self._on_publish, tail_cache.clear)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None) -> Connection:
+        protocol, subprotocol = negotiate(websocket.scope.get("subprotocols", ()))
+        await websocket.accept(subprotocol=subprotocol)
+        connection = Connection(websocket, self.queue_size, user_id, protocol)
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.connections.add(connection)
+        WS_CONNECTIONS.inc()
+        return connection
+
+    def disconnect(self, connection: Connection):
+        if connection not in self.connections:
+            return
+        self.connections.discard(connection)
+        self.limiter.forget(id(connection))
+        WS_CONNECTIONS.dec()
+        for key in list(connection.subscriptions):
+            self._drop_subscription(connection, key)
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    async def subscribe(self, connection: Connection, kind: str, conversation_id: int):
+        key = (kind, conversation_id)
+        if connection not in self.connections or key in connection.subscriptions:
+            return
+        connection.subscriptions.add(key)
+        self.subscribers.setdefault(key, set()).add(connection)
+        WS_SUBSCRIPTIONS.inc()
+        await self.broker.subscribe(self._channel(key))
+        # Only a channel that is actually listened on keeps a tail complete.
+        if key in self.subscribers:
+            tail_cache.track(kind, conversation_id)
+
+    def unsubscribe(self, connection: Connection, kind: str, conversation_id: int):
+        self._drop_subscription(connection, (kind, conversation_id))
+
+    # Every inbound frame is charged to the connection's bucket before it is
+    # decoded or answered. Refused frames are dropped; only the first of a
+    # run gets an error frame. Frames that do not decode under the negotiated
+    # protocol are answered with an error frame; the socket stays open.
+    async def receive(self, connection: Connection):
+        while True:
+            message = await connection.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+            retry_after = await self.limiter.check(id(connection))
+            if retry_after:
+                if not connection.throttled:
+                    connection.throttled = True
+                    await self.send(
+                        connection, {"type": "error", "error": "Rate limit exceeded", "retry_after": retry_after}
+                    )
+                continue
+            connection.throttled = False
+            data = message.get("bytes")
+            try:
+                return connection.protocol.decode(data if data is not None else message["text"])
+            except (ValueError, TypeError) as exc:
+                await self.send(connection, {"type": "error", "error": f"Malformed frame: {exc}"})
+
+    # Never waits on the queue: a writer that died or stalled would otherwise
+    # block the handler forever, and its cleanup would never run.
+    async def send(self, connection: Connection, message: dict):
+        if connection not in self.connections:
+            return
+        if not connection.enqueue(connection.protocol.encode(message), self.overflow_policy):
+            self._drop(connection, "slow", "Slow consumer")
+
+    async def broadcast(self, kind: str, conversation_id: int, message: dict):
+        # Broadcasts follow a committed write: a failed publish is logged, and
+        # must not fail the request or drop the sender's socket before its ack.
+        try:
+            await self.broker.publish(self._channel((kind, conversation_id)), json_protocol.encode(message))
+        except Exception:
+            logger.exception("Failed to publish to %s %s", kind, conversation_id)
+            BROADCAST_PUBLISH_ERRORS.inc()
+
+    # For writes: the event is published in the writing transaction, so it is
+    # delivered everywhere exactly when the write becomes visible.
+    async def broadcast_in(self, db: AsyncSession, kind: str, conversation_id: int, message: dict):
+        await self.broker.publish_in(db, self._channel((kind, conversation_id)), json_protocol.encode(message))
+
+    def _on_publish(self, channel: str, payload: str):
+        started = time.perf_counter()
+        kind, conversation_id = channel.rsplit("_", 1)
+        conversation_id = int(conversation_id)
+        tail_cache.add_payload(kind, conversation_id, payload)
+        connections = list(self.subscribers.get((kind, conversation_id), ()))
+        # Each protocol encodes the broadcast once, however many sockets speak it.
+        frames = {}
+        for connection in connections:
+            frame = frames.get(connection.protocol)
+            if frame is None:
+                frame = frames[connection.protocol] = connection.protocol.transcode(payload)
+            if not connection.enqueue(frame, self.overflow_policy):
+                self._drop(connection, "slow", "Slow consumer")
+        BROADCAST_FANOUT.observe(len(connections))
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+
+    def _drop_subscription(self, connection: Connection, key: ConversationKey):
+        if key not in connection.subscriptions:
+            return
+        connection.subscriptions.discard(key)
+        WS_SUBSCRIPTIONS.dec()
+        subscribers = self.subscribers.get(key)
+        if subscribers is None:
+            return
+        subscribers.discard(connection)
+        if not subscribers:
+            del self.subscribers[key]
+            tail_cache.untrack(*key)
+            asyncio.create_task(self._release(key))
+
+    async def _release(self, key: ConversationKey):
+        if key not in self.subscribers:
+            await self.broker.unsubscribe(self._channel(key))
+
+    def _drop(self, connection: Connection, reason: str, message: str):
+        self.disconnect(connection)
+        WS_CONNECTIONS_REAPED.labels(reason).inc()
+        asyncio.create_task(self._close(connection.websocket, message))
+
+    @staticmethod
+    def _channel(key: ConversationKey) -> str:
+        return f"{key[0]}_{key[1]}"
+
+    async def _writer(self, connection: Connection):
+        try:
+            while True:
+                payload = await connection.queue.get()
+                if isinstance(payload, bytes):
+                    await connection.websocket.send_bytes(payload)
+                else:
+                    await connection.websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Closing the socket also ends the handler's receive loop.
+            self._drop(connection, "send_failed", "Send failed")
+
+    @staticmethod
+    async def _close(websocket: WebSocket, reason: str):
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=reason), CLOSE_TIMEOUT
+            )
+        except Exception:
+            pass
+
+manager = ConnectionManager()
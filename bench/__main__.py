@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from bench.run import run
+from bench.seed import seed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Chat load and latency benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="Seed a benchmark dataset into DATABASE_URL")
+    seed_parser.add_argument("--users", type=int, default=1000)
+    seed_parser.add_argument("--chats", type=int, default=500)
+    seed_parser.add_argument("--groups", type=int, default=5)
+    seed_parser.add_argument("--group-size", type=int, default=500)
+    seed_parser.add_argument("--history", type=int, default=1000, help="Messages per chat and per group")
+    seed_parser.add_argument("--manifest", default="bench_manifest.json")
+    seed_parser.add_argument("--seed", type=int, default=0, help="Seed for the random membership, stored in the manifest")
+
+    run_parser = subparsers.add_parser("run", help="Run the WebSocket and REST load scenario")
+    run_parser.add_argument("--manifest", default="bench_manifest.json")
+    run_parser.add_argument("--clients", type=int, default=100, help="Concurrent WebSocket clients")
+    run_parser.add_argument("--chats", type=int, default=50, help="Chats the clients are spread over")
+    run_parser.add_argument("--messages", type=int, default=100, help="Messages sent by each client")
+    run_parser.add_argument("--interval", type=float, default=0.01, help="Delay between sends, seconds")
+    run_parser.add_argument("--pollers", type=int, default=10, help="Concurrent REST pollers")
+    run_parser.add_argument("--poll-interval", type=float, default=0.1)
+    run_parser.add_argument("--drain-timeout", type=float, default=60)
+    run_parser.add_argument("--url", help="Benchmark a running server instead of starting one in-process")
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--multiplexed", action="store_true", help="Use one /chat/ws socket per client")
+    run_parser.add_argument("--msgpack", action="store_true", help="Speak the MessagePack subprotocol")
+    run_parser.add_argument("--output", help="Write the JSON report to a file instead of stdout")
+
+    args = parser.parse_args(argv)
+    if args.command == "seed":
+        manifest = asyncio.run(seed(
+            args.users, args.chats, args.groups, args.group_size, args.history, args.manifest, args.seed
+        ))
+        print(f"Seeded {len(manifest['users'])} users, {len(manifest['chats'])} chats, "
+              f"{len(manifest['groups'])} groups into {args.manifest}", file=sys.stderr)
+        return
+
+    report = asyncio.run(run(
+        args.manifest, args.clients, args.chats, args.messages, args.interval,
+        args.pollers, args.poll_interval, args.drain_timeout, args.url, args.port, args.multiplexed,
+        args.msgpack
+    ))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
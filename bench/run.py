@@ -0,0 +1,230 @@
+import asyncio
+import json
+import statistics
+import time
+from collections import defaultdict
+from typing import Optional
+from uuid import uuid4
+
+import httpx
+import websockets
+from sqlalchemy import event
+
+from app.auth import create_access_token
+from app.database import engine, replica_engine
+from app.protocols import Protocol, json_protocol, msgpack_protocol
+
+
+class Recorder:
+    def __init__(self):
+        self.sent: dict[str, float] = {}
+        self.expected = 0
+        self.deliveries: list[float] = []
+        self.rest: dict[str, list[float]] = defaultdict(list)
+        self.errors = 0
+        self.received_bytes = 0
+        self.drained = asyncio.Event()
+
+    def delivered(self, client_msg_id: str):
+        sent_at = self.sent.get(client_msg_id)
+        if sent_at is None:
+            return
+        self.deliveries.append((time.perf_counter() - sent_at) * 1000)
+        if len(self.deliveries) >= self.expected:
+            self.drained.set()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.engines = {engine.sync_engine, replica_engine.sync_engine}
+
+    def install(self):
+        for sync_engine in self.engines:
+            event.listen(sync_engine, "before_cursor_execute", self._before)
+            event.listen(sync_engine, "after_cursor_execute", self._after)
+
+    def remove(self):
+        for sync_engine in self.engines:
+            event.remove(sync_engine, "before_cursor_execute", self._before)
+            event.remove(sync_engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bench_query_start", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.seconds += time.perf_counter() - conn.info["bench_query_start"].pop()
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    if len(samples) == 1:
+        return {"count": 1, "p50": samples[0], "p95": samples[0], "p99": samples[0], "max": samples[0]}
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"count": len(samples), "p50": q[49], "p95": q[94], "p99": q[98], "max": max(samples)}
+
+
+def token_for(manifest: dict, user_id: int) -> str:
+    return create_access_token(data={"sub": manifest["user_names"][str(user_id)], "uid": user_id})
+
+
+def send_frame(chat_id: int, user_id: int, text: str, client_msg_id: str, multiplexed: bool) -> dict:
+    if multiplexed:
+        return {"type": "send", "kind": "chat", "chat_id": chat_id, "text": text, "client_msg_id": client_msg_id}
+    return {"chat_id": chat_id, "sender_id": user_id, "text": text, "client_msg_id": client_msg_id}
+
+
+async def ws_client(url: str, chat_id: int, user_id: int, messages: int, interval: float, multiplexed: bool,
+                    protocol: Protocol, recorder: Recorder, connected: asyncio.Barrier, start: asyncio.Event,
+                    done: asyncio.Event):
+    subprotocols = [protocol.name] if protocol is not json_protocol else None
+    async with websockets.connect(url, subprotocols=subprotocols) as ws:
+        async def receive():
+            async for frame in ws:
+                recorder.received_bytes += len(frame if isinstance(frame, bytes) else frame.encode())
+                data = protocol.decode(frame)
+                if data.get("type") == "message":
+                    recorder.delivered(data["client_msg_id"])
+
+        receiver = asyncio.create_task(receive())
+        await connected.wait()
+        await start.wait()
+        for i in range(messages):
+            client_msg_id = uuid4().hex
+            recorder.sent[client_msg_id] = time.perf_counter()
+            await ws.send(protocol.encode(send_frame(chat_id, user_id, f"bench message {i}", client_msg_id, multiplexed)))
+            if interval:
+                await asyncio.sleep(interval)
+        await done.wait()
+        receiver.cancel()
+
+
+async def rest_poller(client: httpx.AsyncClient, manifest: dict, chat_id: int, interval: float,
+                      recorder: Recorder, stop: asyncio.Event):
+    user_id = manifest["chats"][str(chat_id)][0]
+    headers = {"Authorization": f"Bearer {token_for(manifest, user_id)}"}
+    requests = {"history": f"/chat/history/{chat_id}?limit=50", "unread": "/chat/unread"}
+    while not stop.is_set():
+        for name, path in requests.items():
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            if response.status_code != 200:
+                recorder.errors += 1
+            recorder.rest[name].append((time.perf_counter() - started) * 1000)
+        if interval:
+            await asyncio.sleep(interval)
+
+
+async def _serve_in_process(port: int):
+    import uvicorn
+    from app.main import app
+    from app.ratelimit import send_limiter, frame_limiter
+
+    # Clients send every --interval seconds, far above the per-user and
+    # per-socket limits; the bench measures delivery, not throttling.
+    send_limiter.rate = frame_limiter.rate = 0
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run(manifest_path: str, clients: int, chats: int, messages: int, interval: float,
+              pollers: int, poll_interval: float, drain_timeout: float,
+              url: Optional[str] = None, port: int = 8765, multiplexed: bool = False,
+              use_msgpack: bool = False) -> dict:
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    server = counter = None
+    if url is None:
+        server, server_task = await _serve_in_process(port)
+        counter = QueryCounter()
+        counter.install()
+        url = f"http://127.0.0.1:{port}"
+    ws_url = url.replace("http", "ws", 1)
+    protocol = msgpack_protocol if use_msgpack else json_protocol
+
+    chat_ids = [int(chat_id) for chat_id in manifest["chats"]][:chats]
+    recorder = Recorder()
+    connected = asyncio.Barrier(clients + 1)
+    start, done, stop = asyncio.Event(), asyncio.Event(), asyncio.Event()
+
+    tasks = []
+    clients_per_chat = defaultdict(int)
+    sockets_per_user = defaultdict(int)
+    for i in range(clients):
+        chat_id = chat_ids[i % len(chat_ids)]
+        user_id = manifest["chats"][str(chat_id)][i // len(chat_ids) % 2]
+        clients_per_chat[chat_id] += 1
+        sockets_per_user[user_id] += 1
+        path = "/chat/ws" if multiplexed else f"/chat/ws/{chat_id}"
+        tasks.append(asyncio.create_task(ws_client(
+            f"{ws_url}{path}?token={token_for(manifest, user_id)}",
+            chat_id, user_id, messages, interval, multiplexed, protocol, recorder, connected, start, done
+        )))
+    if multiplexed:
+        # Every socket of a chat member receives the chat, whichever chat it was opened for.
+        recorder.expected = sum(
+            n * messages * sum(sockets_per_user[member] for member in manifest["chats"][str(chat_id)])
+            for chat_id, n in clients_per_chat.items()
+        )
+    else:
+        recorder.expected = sum(n * n * messages for n in clients_per_chat.values())
+
+    async with httpx.AsyncClient(base_url=url) as http:
+        poller_tasks = [
+            asyncio.create_task(rest_poller(http, manifest, chat_ids[i % len(chat_ids)], poll_interval, recorder, stop))
+            for i in range(pollers)
+        ]
+        await connected.wait()
+        if counter is not None:
+            counter.count, counter.seconds = 0, 0.0
+        started = time.perf_counter()
+        start.set()
+        try:
+            await asyncio.wait_for(recorder.drained.wait(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        stop.set()
+        done.set()
+        await asyncio.gather(*tasks, *poller_tasks, return_exceptions=True)
+
+    if server is not None:
+        counter.remove()
+        server.should_exit = True
+        await server_task
+
+    messages_sent = len(recorder.sent)
+    rest_requests = sum(len(samples) for samples in recorder.rest.values())
+    report = {
+        "config": {
+            "clients": clients, "chats": len(chat_ids), "messages_per_client": messages,
+            "send_interval": interval, "pollers": pollers, "poll_interval": poll_interval,
+            "in_process": server is not None, "multiplexed": multiplexed, "protocol": protocol.name,
+        },
+        "duration_seconds": elapsed,
+        "messages_sent": messages_sent,
+        "messages_per_second": messages_sent / elapsed if elapsed else None,
+        "deliveries": len(recorder.deliveries),
+        "deliveries_expected": recorder.expected,
+        "deliveries_per_second": len(recorder.deliveries) / elapsed if elapsed else None,
+        "delivery_latency_ms": percentiles(recorder.deliveries),
+        "ws_bytes_received": recorder.received_bytes,
+        "rest_latency_ms": {name: percentiles(samples) for name, samples in recorder.rest.items()},
+        "rest_errors": recorder.errors,
+    }
+    if counter is not None:
+        operations = messages_sent + rest_requests
+        report["db"] = {
+            "queries": counter.count,
+            "query_seconds": counter.seconds,
+            "queries_per_operation": counter.count / operations if operations else None,
+        }
+    return report
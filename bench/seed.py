@@ -0,0 +1,89 @@
+import json
+import random
+from uuid import uuid4
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.auth import get_password_hash
+from app.database import async_session
+from app.membership import CHAT, GROUP
+from app.models import User, Chat, Group, Chat_Users, Group_Users
+from app.repository import insert_messages
+from app.schemas import MessageCreate
+
+BENCH_PASSWORD = "bench"
+INSERT_BATCH_SIZE = 1000
+
+
+def _batches(items: list, size: int = INSERT_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def _insert_returning_ids(db, table, rows: list) -> list[int]:
+    ids = []
+    for batch in _batches(rows):
+        result = await db.execute(insert(table).values(batch).returning(table.c.id))
+        ids.extend(result.scalars().all())
+    return ids
+
+
+async def seed(users: int, chats: int, groups: int, group_size: int, history: int, manifest_path: str, seed: int = 0):
+    # Membership is drawn from a seeded generator, so runs with the same seed
+    # and sizes produce the same dataset shape.
+    rng = random.Random(seed)
+    prefix = uuid4().hex[:8]
+    password = get_password_hash(BENCH_PASSWORD)
+
+    async with async_session() as db:
+        user_ids = await _insert_returning_ids(db, User.__table__, [
+            {"name": f"bench_{prefix}_{i}", "email": f"bench_{prefix}_{i}@example.com", "password": password}
+            for i in range(users)
+        ])
+
+        chat_ids = await _insert_returning_ids(db, Chat.__table__, [{"message_count": 0} for _ in range(chats)])
+        chat_members = {}
+        for chat_id in chat_ids:
+            chat_members[chat_id] = rng.sample(user_ids, 2)
+        for batch in _batches([
+            {"chat_id": chat_id, "user_id": user_id}
+            for chat_id, members in chat_members.items() for user_id in members
+        ]):
+            await db.execute(insert(Chat_Users).values(batch))
+
+        group_ids = await _insert_returning_ids(db, Group.__table__, [
+            {"name": f"bench_{prefix}_group_{i}", "creator_id": user_ids[0]} for i in range(groups)
+        ])
+        group_members = {}
+        for group_id in group_ids:
+            group_members[group_id] = rng.sample(user_ids, min(group_size, len(user_ids)))
+        for batch in _batches([
+            {"group_id": group_id, "user_id": user_id}
+            for group_id, members in group_members.items() for user_id in members
+        ]):
+            await db.execute(insert(Group_Users).values(batch))
+        await db.commit()
+
+        for kind, conversations in ((CHAT, chat_members), (GROUP, group_members)):
+            for conversation_id, members in conversations.items():
+                messages = [
+                    MessageCreate(
+                        chat_id=conversation_id, sender_id=members[i % len(members)], text=f"history message {i}"
+                    )
+                    for i in range(history)
+                ]
+                for batch in _batches(messages):
+                    await insert_messages(db, batch, kind)
+                await db.commit()
+
+    manifest = {
+        "prefix": prefix,
+        "seed": seed,
+        "users": user_ids,
+        "user_names": {str(user_id): f"bench_{prefix}_{i}" for i, user_id in enumerate(user_ids)},
+        "chats": {str(chat_id): members for chat_id, members in chat_members.items()},
+        "groups": {str(group_id): members for group_id, members in group_members.items()},
+    }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+    return manifest
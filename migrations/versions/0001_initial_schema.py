@@ -0,0 +1,115 @@
+"""initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by the old create_all() on startup already have the
+    # tables; only the missing pieces and the indexes are added for them.
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if "users" not in tables:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("password", sa.String(), nullable=False),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.create_index("ix_users_name", "users", ["name"], if_not_exists=True)
+
+    if "chats" not in tables:
+        op.create_table(
+            "chats",
+            sa.Column("id", sa.Integer(), primary_key=True),
+        )
+        op.create_index("ix_chats_id", "chats", ["id"])
+
+    if "groups" not in tables:
+        op.create_table(
+            "groups",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("creator_id", sa.Integer(), sa.ForeignKey("users.id")),
+        )
+        op.create_index("ix_groups_id", "groups", ["id"])
+
+    if "group_users" not in tables:
+        op.create_table(
+            "group_users",
+            sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        )
+    op.create_index("ix_group_users_user_id", "group_users", ["user_id"], if_not_exists=True)
+
+    if "chat_users" not in tables:
+        op.create_table(
+            "chat_users",
+            sa.Column("chat_id", sa.Integer(), sa.ForeignKey("chats.id"), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        )
+    op.create_index("ix_chat_users_user_id", "chat_users", ["user_id"], if_not_exists=True)
+
+    if "messages" not in tables:
+        op.create_table(
+            "messages",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("chat_id", sa.Integer(), sa.ForeignKey("chats.id"), nullable=False),
+            sa.Column("sender_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("text", sa.String(), nullable=False),
+            sa.Column("timestamp", sa.DateTime(timezone=True)),
+            sa.Column("read", sa.Boolean()),
+            sa.Column("client_msg_id", sa.String(), nullable=True),
+            sa.UniqueConstraint("sender_id", "client_msg_id", name="uq_messages_sender_id_client_msg_id"),
+        )
+        op.create_index("ix_messages_id", "messages", ["id"])
+    else:
+        columns = {column["name"] for column in inspector.get_columns("messages")}
+        if "client_msg_id" not in columns:
+            op.add_column("messages", sa.Column("client_msg_id", sa.String(), nullable=True))
+            op.create_unique_constraint(
+                "uq_messages_sender_id_client_msg_id", "messages", ["sender_id", "client_msg_id"]
+            )
+    op.create_index(
+        "ix_messages_chat_id_timestamp_id", "messages", ["chat_id", "timestamp", "id"], if_not_exists=True
+    )
+
+    if "group_messages" not in tables:
+        op.create_table(
+            "group_messages",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+            sa.Column("chat_id", sa.Integer(), sa.ForeignKey("chats.id"), nullable=False),
+            sa.Column("sender_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("text", sa.String(), nullable=False),
+            sa.Column("timestamp", sa.DateTime(timezone=True)),
+            sa.Column("read", sa.Boolean()),
+        )
+        op.create_index("ix_group_messages_id", "group_messages", ["id"])
+    op.create_index(
+        "ix_group_messages_group_id_timestamp", "group_messages", ["group_id", "timestamp"], if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table("group_messages")
+    op.drop_table("messages")
+    op.drop_table("chat_users")
+    op.drop_table("group_users")
+    op.drop_table("groups")
+    op.drop_table("chats")
+    op.drop_table("users")
@@ -0,0 +1,46 @@
+"""read watermarks and unread counters
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ("chats", "groups"):
+        op.add_column(table, sa.Column("message_count", sa.BigInteger(), nullable=False, server_default="0"))
+    for table in ("chat_users", "group_users"):
+        op.add_column(table, sa.Column("read_count", sa.BigInteger(), nullable=False, server_default="0"))
+        op.add_column(table, sa.Column("last_read_message_id", sa.Integer(), nullable=True))
+
+    # Existing history is treated as already read.
+    op.execute(
+        """
+        UPDATE chats SET message_count = counts.n
+        FROM (SELECT chat_id, count(*) AS n FROM messages GROUP BY chat_id) AS counts
+        WHERE chats.id = counts.chat_id
+        """
+    )
+    op.execute(
+        """
+        UPDATE chat_users SET read_count = chats.message_count, last_read_message_id = latest.id
+        FROM chats, (SELECT chat_id, max(id) AS id FROM messages GROUP BY chat_id) AS latest
+        WHERE chats.id = chat_users.chat_id AND latest.chat_id = chat_users.chat_id
+        """
+    )
+
+
+def downgrade():
+    for table in ("chat_users", "group_users"):
+        op.drop_column(table, "last_read_message_id")
+        op.drop_column(table, "read_count")
+    for table in ("chats", "groups"):
+        op.drop_column(table, "message_count")
@@ -0,0 +1,28 @@
+"""full-text search over messages
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "messages",
+        sa.Column("search_vector", TSVECTOR(), sa.Computed("to_tsvector('simple', text)", persisted=True)),
+    )
+    op.create_index("ix_messages_search_vector", "messages", ["search_vector"], postgresql_using="gin")
+
+
+def downgrade():
+    op.drop_index("ix_messages_search_vector", table_name="messages")
+    op.drop_column("messages", "search_vector")
@@ -0,0 +1,165 @@
+"""separate group message storage, partition messages by month
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+"""
+from datetime import date, datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_partitioned_table(table: str, conversation_column: str, conversation_table: str):
+    op.execute(
+        f"""
+        CREATE TABLE {table} (
+            id integer NOT NULL DEFAULT nextval('{table}_id_seq'),
+            {conversation_column} integer NOT NULL REFERENCES {conversation_table} (id),
+            sender_id integer NOT NULL REFERENCES users (id),
+            text varchar NOT NULL,
+            "timestamp" timestamptz NOT NULL,
+            read boolean,
+            client_msg_id varchar,
+            search_vector tsvector GENERATED ALWAYS AS (to_tsvector('simple', text)) STORED,
+            PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+        """
+    )
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.create_index(f"ix_{table}_id", table, ["id"])
+    op.create_index(
+        f"ix_{table}_{conversation_column}_timestamp_id", table, [conversation_column, "timestamp", "id"]
+    )
+    op.create_index(f"ix_{table}_search_vector", table, ["search_vector"], postgresql_using="gin")
+
+
+def _create_partitions(table: str, first: date, last: date):
+    month = first
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE {table}_{month:%Y_%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month} 00:00:00+00') TO ('{_add_months(month, 1)} 00:00:00+00')"
+        )
+        month = _add_months(month, 1)
+
+
+def upgrade():
+    op.create_table(
+        "message_keys",
+        sa.Column("kind", sa.String(), primary_key=True),
+        sa.Column("sender_id", sa.Integer(), primary_key=True),
+        sa.Column("client_msg_id", sa.String(), primary_key=True),
+        sa.Column("message_id", sa.Integer(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_message_keys_timestamp", "message_keys", ["timestamp"])
+
+    # The old messages table is rebuilt as a partitioned one. Its id sequence
+    # is kept so existing ids (and read markers pointing at them) stay valid.
+    op.rename_table("messages", "messages_legacy")
+    op.execute("ALTER TABLE messages_legacy ALTER COLUMN id DROP DEFAULT")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey")
+    op.execute("ALTER TABLE messages_legacy DROP CONSTRAINT IF EXISTS uq_messages_sender_id_client_msg_id")
+    for index in ("ix_messages_id", "ix_messages_chat_id_timestamp_id", "ix_messages_search_vector"):
+        op.execute(f"DROP INDEX IF EXISTS {index}")
+    _create_partitioned_table("messages", "chat_id", "chats")
+
+    # group_messages was never written to: group traffic went to messages.
+    op.drop_table("group_messages")
+    op.execute("CREATE SEQUENCE group_messages_id_seq AS integer")
+    _create_partitioned_table("group_messages", "group_id", "groups")
+
+    today = datetime.now(timezone.utc).date()
+    current = date(today.year, today.month, 1)
+    oldest = op.get_bind().execute(sa.text('SELECT min("timestamp") FROM messages_legacy')).scalar()
+    first = current
+    if oldest is not None:
+        oldest = oldest.astimezone(timezone.utc)
+        first = min(date(oldest.year, oldest.month, 1), current)
+    _create_partitions("messages", first, _add_months(current, MONTHS_AHEAD))
+    _create_partitions("group_messages", current, _add_months(current, MONTHS_AHEAD))
+
+    op.execute(
+        """
+        INSERT INTO messages (id, chat_id, sender_id, text, "timestamp", read, client_msg_id)
+        SELECT id, chat_id, sender_id, text, coalesce("timestamp", now()), read, client_msg_id
+        FROM messages_legacy
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO message_keys (kind, sender_id, client_msg_id, message_id, "timestamp")
+        SELECT 'chat', sender_id, client_msg_id, id, "timestamp"
+        FROM messages
+        WHERE client_msg_id IS NOT NULL
+        """
+    )
+    op.drop_table("messages_legacy")
+
+
+def downgrade():
+    op.rename_table("messages", "messages_partitioned")
+    op.execute("ALTER TABLE messages_partitioned ALTER COLUMN id DROP DEFAULT")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey")
+    for index in ("ix_messages_id", "ix_messages_chat_id_timestamp_id", "ix_messages_search_vector"):
+        op.execute(f"DROP INDEX {index}")
+
+    op.create_table(
+        "messages",
+        sa.Column("id", sa.Integer(), sa.Sequence("messages_id_seq"), primary_key=True),
+        sa.Column("chat_id", sa.Integer(), sa.ForeignKey("chats.id"), nullable=False),
+        sa.Column("sender_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("text", sa.String(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(timezone=True)),
+        sa.Column("read", sa.Boolean()),
+        sa.Column("client_msg_id", sa.String(), nullable=True),
+        sa.Column("search_vector", TSVECTOR(), sa.Computed("to_tsvector('simple', text)", persisted=True)),
+        sa.UniqueConstraint("sender_id", "client_msg_id", name="uq_messages_sender_id_client_msg_id"),
+    )
+    op.execute("ALTER TABLE messages ALTER COLUMN id SET DEFAULT nextval('messages_id_seq')")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute(
+        """
+        INSERT INTO messages (id, chat_id, sender_id, text, "timestamp", read, client_msg_id)
+        SELECT id, chat_id, sender_id, text, "timestamp", read, client_msg_id
+        FROM messages_partitioned
+        """
+    )
+    op.create_index("ix_messages_id", "messages", ["id"])
+    op.create_index("ix_messages_chat_id_timestamp_id", "messages", ["chat_id", "timestamp", "id"])
+    op.create_index("ix_messages_search_vector", "messages", ["search_vector"], postgresql_using="gin")
+    op.drop_table("messages_partitioned")
+
+    # Group messages cannot be folded back into messages: their ids come from
+    # a separate sequence and their group ids are not chat ids.
+    op.drop_table("group_messages")
+    op.create_table(
+        "group_messages",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+        sa.Column("chat_id", sa.Integer(), sa.ForeignKey("chats.id"), nullable=False),
+        sa.Column("sender_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("text", sa.String(), nullable=False),
+        sa.Column("timestamp", sa.DateTime(timezone=True)),
+        sa.Column("read", sa.Boolean()),
+    )
+    op.create_index("ix_group_messages_id", "group_messages", ["id"])
+    op.create_index("ix_group_messages_group_id_timestamp", "group_messages", ["group_id", "timestamp"])
+    op.drop_table("message_keys")
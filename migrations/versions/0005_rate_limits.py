@@ -0,0 +1,31 @@
+"""shared rate limit buckets
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "rate_limits",
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("tokens", sa.Float(), nullable=False),
+        sa.Column("allowed", sa.Boolean(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        prefixes=["UNLOGGED"],
+    )
+    op.create_index("ix_rate_limits_updated_at", "rate_limits", ["updated_at"])
+
+
+def downgrade():
+    op.drop_index("ix_rate_limits_updated_at", table_name="rate_limits")
+    op.drop_table("rate_limits")
@@ -0,0 +1,42 @@
+"""last message and activity time on chats and groups
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+_tables = (("chats", "messages", "chat_id"), ("groups", "group_messages", "group_id"))
+
+
+def upgrade():
+    for table, messages, column in _tables:
+        op.add_column(table, sa.Column("last_message_id", sa.Integer(), nullable=True))
+        op.add_column(
+            table,
+            sa.Column("last_activity_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now())
+        )
+        # Conversations without messages keep the migration time as their activity.
+        op.execute(
+            f"""
+            UPDATE {table} SET last_message_id = latest.id, last_activity_at = latest."timestamp"
+            FROM (
+                SELECT DISTINCT ON ({column}) {column}, id, "timestamp" FROM {messages}
+                ORDER BY {column}, "timestamp" DESC, id DESC
+            ) AS latest
+            WHERE {table}.id = latest.{column}
+            """
+        )
+
+
+def downgrade():
+    for table, _, _ in _tables:
+        op.drop_column(table, "last_activity_at")
+        op.drop_column(table, "last_message_id")
@@ -0,0 +1,53 @@
+"""idempotency keys scoped to their conversation
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+_tables = (("chat", "messages", "chat_id"), ("group", "group_messages", "group_id"))
+
+
+def upgrade():
+    op.add_column("message_keys", sa.Column("conversation_id", sa.Integer(), nullable=True))
+    for kind, messages, column in _tables:
+        op.execute(
+            f"""
+            UPDATE message_keys SET conversation_id = {messages}.{column}
+            FROM {messages}
+            WHERE message_keys.kind = '{kind}'
+              AND {messages}.id = message_keys.message_id
+              AND {messages}."timestamp" = message_keys."timestamp"
+            """
+        )
+    # Keys whose message lives in a detached partition can no longer be replayed.
+    op.execute("DELETE FROM message_keys WHERE conversation_id IS NULL")
+    op.alter_column("message_keys", "conversation_id", nullable=False)
+    op.drop_constraint("message_keys_pkey", "message_keys", type_="primary")
+    op.create_primary_key(
+        "message_keys_pkey", "message_keys", ["kind", "conversation_id", "sender_id", "client_msg_id"]
+    )
+
+
+def downgrade():
+    # A key reused across conversations keeps only its first message.
+    op.execute(
+        """
+        DELETE FROM message_keys AS newer USING message_keys AS older
+        WHERE newer.kind = older.kind
+          AND newer.sender_id = older.sender_id
+          AND newer.client_msg_id = older.client_msg_id
+          AND newer.message_id > older.message_id
+        """
+    )
+    op.drop_constraint("message_keys_pkey", "message_keys", type_="primary")
+    op.create_primary_key("message_keys_pkey", "message_keys", ["kind", "sender_id", "client_msg_id"])
+    op.drop_column("message_keys", "conversation_id")
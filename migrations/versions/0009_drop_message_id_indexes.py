@@ -0,0 +1,26 @@
+"""drop the id indexes duplicated by the message primary keys
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+_tables = ("messages", "group_messages")
+
+
+def upgrade():
+    # The (id, timestamp) primary key already serves lookups by id.
+    for table in _tables:
+        op.drop_index(f"ix_{table}_id", table_name=table)
+
+
+def downgrade():
+    for table in _tables:
+        op.create_index(f"ix_{table}_id", table, ["id"])
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.membership import CHAT
+from app.schemas import MessageCreate
+from app.serializers import MessageRecord
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class RecordingResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return list(self.rows)
+
+    def scalars(self):
+        return self
+
+    def scalar(self):
+        return self.rows[0] if self.rows else None
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class RecordingSession:
+    # Stands in for an AsyncSession: records each statement and answers with
+    # the queued rows, so query construction can be checked without a server.
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+        self.closed = False
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        return RecordingResult(self.results.pop(0) if self.results else [])
+
+    async def get(self, model, key):
+        rows = self.results.pop(0) if self.results else []
+        return rows[0] if rows else None
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+
+def compile_sql(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def record(message_id: int) -> MessageRecord:
+    # A stored chat message, one second after START per id.
+    return MessageRecord(message_id, CHAT, 1, 1, f"message {message_id}", START + timedelta(seconds=message_id), False, None)
+
+
+def records(ids) -> list[MessageRecord]:
+    return [record(message_id) for message_id in ids]
+
+
+def message(text: str, key=None, chat_id: int = 1) -> MessageCreate:
+    return MessageCreate(chat_id=chat_id, sender_id=1, text=text, client_msg_id=key)
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    from app.auth import CurrentUser, get_current_user
+    from app.database import get_db, get_replica_db
+    from app.main import app
+
+    session = RecordingSession()
+
+    async def override_db():
+        yield session
+
+    app.dependency_overrides[get_current_user] = lambda: CurrentUser(id=1, name="alice")
+    app.dependency_overrides[get_db] = override_db
+    app.dependency_overrides[get_replica_db] = override_db
+    # Startup is not run: it would verify the schema against a live database.
+    test_client = TestClient(app)
+    test_client.session = session
+    yield test_client
+    app.dependency_overrides.clear()
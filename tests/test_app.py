@@ -0,0 +1,6 @@
+from app.main import app
+
+
+def test_app_imports_and_registers_routes():
+    paths = {route.path for route in app.routes}
+    assert {"/chat/history/{chat_id}", "/chat/search", "/chat/ws", "/chat/ws/{chat_id}"} <= paths
@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from app.broker import NOTIFY_PAYLOAD_LIMIT, CHUNK_MARKER, Broker, ChunkAssembler, InMemoryBroker, split_payload
+from app.schemas import MESSAGE_MAX_LENGTH, MessageCreate
+from app.websocket_manager import ConnectionManager
+
+
+def reassemble(chunks, channel="chat_1"):
+    assembler = ChunkAssembler()
+    results = [assembler.feed(channel, chunk) for chunk in chunks]
+    assert results[:-1] == [None] * (len(chunks) - 1)
+    return results[-1]
+
+
+def test_small_payload_is_sent_as_is():
+    assert split_payload('{"text": "hi"}') == ['{"text": "hi"}']
+
+
+@pytest.mark.parametrize("text", ["a" * 9000, "я" * 9000, "💬" * 5000])
+def test_large_payload_is_chunked_under_the_notify_limit(text):
+    payload = '{"text": "' + text + '"}'
+    chunks = split_payload(payload)
+
+    assert len(chunks) > 1
+    assert all(len(chunk.encode()) < NOTIFY_PAYLOAD_LIMIT for chunk in chunks)
+    assert reassemble(chunks) == payload
+
+
+def test_payload_that_looks_like_a_chunk_is_escaped():
+    payload = CHUNK_MARKER + "not really"
+    chunks = split_payload(payload)
+
+    assert chunks != [payload]
+    assert reassemble(chunks) == payload
+
+
+def test_missing_chunk_drops_the_payload():
+    chunks = split_payload("x" * 20000)
+    assembler = ChunkAssembler()
+
+    assert assembler.feed("chat_1", chunks[0]) is None
+    assert assembler.feed("chat_1", chunks[2]) is None
+    assert assembler.partial == {}
+
+
+def test_message_text_is_capped():
+    MessageCreate(chat_id=1, sender_id=1, text="a" * MESSAGE_MAX_LENGTH)
+    with pytest.raises(ValidationError):
+        MessageCreate(chat_id=1, sender_id=1, text="a" * (MESSAGE_MAX_LENGTH + 1))
+
+
+class FailingBroker(Broker):
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+    async def publish(self, channel: str, payload: str):
+        raise RuntimeError("payload string too long")
+
+
+def test_failed_publish_does_not_propagate():
+    manager = ConnectionManager(broker=FailingBroker())
+    asyncio.run(manager.broadcast("chat", 1, {"type": "message", "text": "hi"}))
+
+
+def test_broker_base_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        Broker()
+
+
+@pytest.mark.parametrize("fields", [{"text": "bad\x00"}, {"text": "ok", "client_msg_id": "k\x00"}])
+def test_nul_characters_are_rejected(fields):
+    with pytest.raises(ValidationError):
+        MessageCreate(chat_id=1, sender_id=1, **fields)
+
+
+def test_publish_in_delivers_only_when_the_transaction_commits():
+    broker = InMemoryBroker()
+    delivered = []
+
+    async def publish(db):
+        await broker.publish_in(db, "chat_1", "payload")
+        return delivered.copy()
+
+    async def main():
+        await broker.start(lambda channel, payload: delivered.append(payload))
+        await broker.subscribe("chat_1")
+        committed, rolled_back = SimpleNamespace(sync_session=Session()), SimpleNamespace(sync_session=Session())
+        # A write has already begun the transaction by the time it publishes.
+        committed.sync_session.begin()
+        rolled_back.sync_session.begin()
+        before_commit = await publish(committed)
+        committed.sync_session.commit()
+        await publish(rolled_back)
+        rolled_back.sync_session.rollback()
+        rolled_back.sync_session.commit()
+        return before_commit
+
+    assert asyncio.run(main()) == []
+    assert delivered == ["payload"]
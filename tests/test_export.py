@@ -0,0 +1,53 @@
+import asyncio
+
+import orjson
+
+from app import export
+from app.membership import CHAT
+from conftest import RecordingSession, compile_sql, records
+
+
+def test_export_reads_keyset_batches_in_short_sessions(monkeypatch):
+    batches = [records([1, 2]), records([3, 4]), records([5])]
+    sessions = []
+
+    def session_factory():
+        session = RecordingSession(batches.pop(0))
+        sessions.append(session)
+        return session
+
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(export, "async_replica_session", session_factory)
+
+    async def collect():
+        chunks = []
+        async for chunk in export.export_messages(CHAT, 1):
+            # Nothing is held open while the client consumes a chunk.
+            assert all(session.closed for session in sessions)
+            chunks.append(chunk)
+        return chunks
+
+    body = b"".join(asyncio.run(collect()))
+
+    assert [orjson.loads(line)["id"] for line in body.splitlines()] == [1, 2, 3, 4, 5]
+    assert len(sessions) == 3
+    assert "(messages.timestamp, messages.id) >" not in compile_sql(sessions[0].statements[0])
+    assert "(messages.timestamp, messages.id) >" in compile_sql(sessions[1].statements[0])
+
+
+def test_export_of_an_empty_conversation_opens_one_session(monkeypatch):
+    sessions = []
+
+    def session_factory():
+        sessions.append(RecordingSession([]))
+        return sessions[-1]
+
+    monkeypatch.setattr(export, "async_replica_session", session_factory)
+
+    async def collect():
+        return [chunk async for chunk in export.export_messages(CHAT, 1, export.CSV)]
+
+    chunks = asyncio.run(collect())
+
+    assert chunks == [b"id,kind,chat_id,sender_id,text,timestamp,read,client_msg_id\r\n"]
+    assert len(sessions) == 1
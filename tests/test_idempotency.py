@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from pydantic import ValidationError
+
+from app.membership import CHAT
+from app.repository import insert_messages
+from app.serializers import MessageRecord
+from conftest import START, RecordingSession, compile_sql, message
+
+NOW = datetime(2026, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def allocated(*ids) -> list:
+    # Rows of the id allocation: each id with the database's now().
+    return [(message_id, NOW) for message_id in ids]
+
+
+def inserted_message_statements(db) -> list:
+    return [statement for statement in db.statements if compile_sql(statement).startswith("INSERT INTO messages ")]
+
+
+def test_repeated_key_within_a_batch_is_stored_once():
+    # Allocated ids, then the keys the insert claimed.
+    db = RecordingSession(allocated(1, 2, 3), [(1, 1, "k1")])
+    results = asyncio.run(insert_messages(db, [message("a", "k1"), message("a again", "k1"), message("b")], CHAT))
+
+    assert [record.id for record in results] == [1, 1, 3]
+    assert results[1].text == "a"
+    [insert] = inserted_message_statements(db)
+    params = insert.compile().params
+    assert sorted(value for name, value in params.items() if name.startswith("id_m")) == [1, 3]
+
+
+def test_retry_of_a_stored_key_returns_the_original():
+    original = MessageRecord(2, CHAT, 1, 1, "first try", START, False, "k1")
+    # Allocated ids, no claimed keys, then the lookup of the original.
+    db = RecordingSession(allocated(5), [], [original])
+    [result] = asyncio.run(insert_messages(db, [message("retry", "k1")], CHAT))
+
+    assert result == original
+    assert inserted_message_statements(db) == []
+
+
+def test_messages_without_a_key_are_never_deduplicated():
+    db = RecordingSession(allocated(1, 2))
+    results = asyncio.run(insert_messages(db, [message("same"), message("same")], CHAT))
+
+    assert [record.id for record in results] == [1, 2]
+    # No key claim is issued when nothing carries a key.
+    assert not any("message_keys" in compile_sql(statement) for statement in db.statements)
+    assert len(inserted_message_statements(db)) == 1
+
+
+def test_key_reused_in_another_chat_is_a_new_message():
+    # The key is claimed for chat 8, so nothing is looked up from chat 1.
+    db = RecordingSession(allocated(5), [(8, 1, "k1")])
+    [result] = asyncio.run(insert_messages(db, [message("elsewhere", "k1", chat_id=8)], CHAT))
+
+    assert (result.id, result.chat_id) == (5, 8)
+    claim = compile_sql(db.statements[1])
+    assert "conversation_id" in claim
+    assert len(inserted_message_statements(db)) == 1
+
+
+def test_timestamps_come_from_the_database_clock():
+    db = RecordingSession(allocated(2, 1))
+    results = asyncio.run(insert_messages(db, [message("a"), message("b")], CHAT))
+
+    assert "now()" in compile_sql(db.statements[0])
+    assert [(record.id, record.timestamp) for record in results] == [(1, NOW), (2, NOW)]
+
+
+def test_overlong_key_is_rejected():
+    with pytest.raises(ValidationError):
+        message("text", "k" * 65)
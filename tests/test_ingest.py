@@ -0,0 +1,102 @@
+import asyncio
+
+import orjson
+import pytest
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app import ingest as ingest_module
+from app.broker import InMemoryBroker
+from app.ingest import IngestFailed, IngestOverloaded, MessageIngest
+from app.serializers import MessageRecord
+from app.websocket_manager import ConnectionManager
+from conftest import START, message
+
+
+class StalledIngest(MessageIngest):
+    # Never finishes a write, like a flush stuck on the database.
+    async def _flush(self, batch: list):
+        await asyncio.Event().wait()
+
+
+def test_stop_fails_the_batch_being_written():
+    async def scenario():
+        ingest = StalledIngest(batch_size=10, flush_interval_ms=0)
+        await ingest.start()
+        sends = [asyncio.create_task(ingest.submit(message(f"m{i}"))) for i in range(3)]
+        while len(ingest.batch) < 3:
+            await asyncio.sleep(0)
+        await ingest.stop()
+        return await asyncio.gather(*sends, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert [type(result) for result in results] == [IngestFailed] * 3
+    assert all(isinstance(result.__cause__, RuntimeError) for result in results)
+
+
+def test_submit_refuses_when_the_queue_is_full():
+    async def scenario():
+        ingest = StalledIngest(batch_size=1, flush_interval_ms=0, queue_size=1)
+        await ingest.start()
+        first = asyncio.create_task(ingest.submit(message("in flight")))
+        while not ingest.batch:
+            await asyncio.sleep(0)
+        queued = asyncio.create_task(ingest.submit(message("queued")))
+        await asyncio.sleep(0)
+        with pytest.raises(IngestOverloaded) as refused:
+            await ingest.submit(message("refused"))
+        await ingest.stop()
+        await asyncio.gather(first, queued, return_exceptions=True)
+        return refused.value
+
+    assert asyncio.run(scenario()).retry_after > 0
+
+
+class FakeSession:
+    # Commits a real, unbound ORM session so transaction events fire.
+    def __init__(self):
+        self.sync_session = Session()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.sync_session.close()
+
+    async def commit(self):
+        self.sync_session.commit()
+
+
+def test_one_bad_row_only_fails_its_own_sender(monkeypatch):
+    async def insert(db, messages_in, kind):
+        if any(message_in.text == "bad" for message_in in messages_in):
+            raise DBAPIError("INSERT", {}, Exception("invalid byte sequence"))
+        return [
+            MessageRecord(ord(message_in.text[0]), kind, 1, 1, message_in.text, START, False, None)
+            for message_in in messages_in
+        ]
+
+    broker = InMemoryBroker()
+    published = []
+    monkeypatch.setattr(ingest_module, "async_session", FakeSession)
+    monkeypatch.setattr(ingest_module, "insert_messages", insert)
+    monkeypatch.setattr(ingest_module, "manager", ConnectionManager(broker=broker))
+    monkeypatch.setattr(ingest_module.tail_cache, "add", lambda records: list(records))
+
+    async def scenario():
+        await broker.start(lambda channel, payload: published.append(orjson.loads(payload)["text"]))
+        await broker.subscribe("chat_1")
+        ingest = MessageIngest(batch_size=3, flush_interval_ms=50)
+        await ingest.start()
+        sends = [asyncio.create_task(ingest.submit(message(text))) for text in ("a", "bad", "b")]
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        await ingest.stop()
+        return results
+
+    first, bad, last = asyncio.run(scenario())
+
+    assert (first.text, last.text) == ("a", "b")
+    assert isinstance(bad, IngestFailed)
+    # The failed batch published nothing; each committed row exactly once.
+    assert published == ["a", "b"]
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from app.membership import CHAT, membership
+from app.pagination import decode_cursor, decode_rank_cursor, encode_cursor
+from app.repository import _get_message_page, search_messages, sync_messages
+from conftest import START, RecordingSession, compile_sql, records
+
+
+class Hit:
+    def __init__(self, message_id, rank):
+        self.id = message_id
+        self.kind = CHAT
+        self.rank = rank
+        self.snippet = ""
+
+
+def test_history_page_returns_oldest_first_with_a_cursor():
+    db = RecordingSession(records([5, 4, 3]))
+    page = asyncio.run(_get_message_page(db, CHAT, 1, 2))
+
+    assert [message.id for message in page["messages"]] == [4, 5]
+    assert decode_cursor(page["next_cursor"]) == (START + timedelta(seconds=4), 4)
+
+
+def test_last_history_page_has_no_cursor():
+    db = RecordingSession(records([2, 1]))
+    page = asyncio.run(_get_message_page(db, CHAT, 1, 2))
+
+    assert [message.id for message in page["messages"]] == [1, 2]
+    assert page["next_cursor"] is None
+
+
+def test_forward_reads_stop_at_the_commit_horizon():
+    db = RecordingSession([], [], [])
+    asyncio.run(_get_message_page(db, CHAT, 1, 2, after=(START, 1)))
+    asyncio.run(sync_messages(db, 1, {CHAT: (START, 1)}))
+    asyncio.run(_get_message_page(db, CHAT, 1, 2))
+
+    after, sync, backward = (compile_sql(statement) for statement in db.statements)
+    assert "now() - " in after
+    assert sync.count("now() - ") == 2
+    assert "now()" not in backward
+
+
+def test_unsettled_sync_reads_up_to_the_latest_commit():
+    db = RecordingSession([])
+    asyncio.run(sync_messages(db, 1, {CHAT: (START, 1)}, settled=False))
+
+    assert "now()" not in compile_sql(db.statements[0])
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_empty_history_page_issues_no_query(limit):
+    db = RecordingSession()
+    assert asyncio.run(_get_message_page(db, CHAT, 1, limit)) == {"messages": [], "next_cursor": None}
+    assert db.statements == []
+
+
+def test_search_pages_by_rank():
+    db = RecordingSession([Hit(9, 0.9), Hit(8, 0.5), Hit(7, 0.1)])
+    page = asyncio.run(search_messages(db, 1, "hello", limit=2))
+
+    assert [hit["message"].id for hit in page["hits"]] == [9, 8]
+    assert decode_rank_cursor(page["next_cursor"]) == (0.5, CHAT, 8)
+
+
+@pytest.mark.parametrize("limit", [0, -5])
+def test_empty_search_page_issues_no_query(limit):
+    db = RecordingSession()
+    assert asyncio.run(search_messages(db, 1, "hello", limit=limit)) == {"hits": [], "next_cursor": None}
+    assert db.statements == []
+
+
+@pytest.mark.parametrize("path", [
+    "/chat/history/1?limit={}",
+    "/chat/group-history/1?limit={}",
+    "/chat/search?q=hi&limit={}",
+    "/chat/sync?limit={}",
+    "/chat/conversations?limit={}",
+])
+@pytest.mark.parametrize("limit", [0, -1, 100000])
+def test_out_of_range_limits_are_rejected(client, path, limit):
+    response = client.get(path.format(limit))
+    assert response.status_code == 422
+
+
+def test_history_endpoint_pages(client):
+    membership.add(CHAT, 1, [1])
+    client.session.results.append(records([3, 2, 1]))
+
+    response = client.get("/chat/history/1?limit=2")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [message["id"] for message in body["messages"]] == [2, 3]
+    assert body["next_cursor"] is not None
+
+
+@pytest.mark.parametrize("path", ["/chat/history/1", "/chat/group-history/1"])
+def test_before_and_after_together_are_rejected(client, path):
+    cursor = encode_cursor(START, 1)
+    response = client.get(f"{path}?before={cursor}&after={cursor}")
+
+    assert response.status_code == 400
+    assert "before" in response.json()["detail"]
+    assert client.session.statements == []
+
+
+@pytest.mark.parametrize("conversation, status_code", [([object()], 403), ([], 404)])
+def test_export_refuses_non_members(client, monkeypatch, conversation, status_code):
+    # Not a member, then the conversation lookup.
+    client.session.results.extend([[False], conversation])
+    monkeypatch.setattr("app.router.async_replica_session", lambda: client.session)
+
+    response = client.get("/chat/export/99")
+
+    assert response.status_code == status_code
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+from app.presence import PresenceRegistry
+
+
+def test_connected_user_is_online_without_last_seen():
+    registry = PresenceRegistry()
+    registry.connected(1)
+
+    assert registry.status(1, None)["online"] is True
+
+
+def test_user_is_offline_right_after_the_last_local_socket_closes():
+    registry = PresenceRegistry()
+    registry.connected(1)
+    registry.connected(1)
+    registry.disconnected(1)
+    assert registry.status(1, None)["online"] is True
+
+    # The row still holds the refresh written while the sockets were open.
+    recent = datetime.now(timezone.utc) - timedelta(seconds=5)
+    registry.disconnected(1)
+
+    assert registry.status(1, recent)["online"] is False
+
+
+def test_refresh_from_another_process_after_local_disconnect_counts():
+    registry = PresenceRegistry()
+    registry.connected(1)
+    registry.disconnected(1)
+
+    later = datetime.now(timezone.utc) + timedelta(seconds=1)
+
+    assert registry.status(1, later)["online"] is True
+
+
+def test_remote_users_use_last_seen_freshness():
+    registry = PresenceRegistry(online_ttl=60)
+    now = datetime.now(timezone.utc)
+
+    assert registry.status(2, now - timedelta(seconds=10))["online"] is True
+    assert registry.status(2, now - timedelta(seconds=120))["online"] is False
+    assert registry.status(2, None)["online"] is False
@@ -0,0 +1,207 @@
+import asyncio
+from datetime import datetime, timezone
+
+import msgpack
+import orjson
+import pytest
+from fastapi import WebSocketDisconnect
+
+from app.broker import InMemoryBroker
+from app.protocols import JSON, MSGPACK, Protocol, json_protocol, msgpack_protocol, negotiate
+from app.ratelimit import RateLimiter
+from app.serializers import dumps
+from app.websocket_manager import ConnectionManager
+
+TIMESTAMP = datetime(2026, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+MESSAGE = {
+    "type": "message", "id": 42, "kind": "chat", "chat_id": 7, "sender_id": 1,
+    "text": "hi", "timestamp": TIMESTAMP, "read": False, "client_msg_id": None,
+}
+COMPACT = {"t": "message", "i": 42, "k": "chat", "c": 7, "s": 1, "x": "hi", "ts": 1767268800123, "r": False, "m": None}
+
+
+class FakeWebSocket:
+    def __init__(self, subprotocols=(), frames=()):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.frames = list(frames)
+        self.subprotocol = "unset"
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def receive(self):
+        if not self.frames:
+            return {"type": "websocket.disconnect", "code": 1000}
+        return self.frames.pop(0)
+
+    async def send_text(self, data):
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+@pytest.mark.parametrize("offered, protocol, subprotocol", [
+    ([], json_protocol, None),
+    (["unknown"], json_protocol, None),
+    ([JSON], json_protocol, JSON),
+    ([MSGPACK], msgpack_protocol, MSGPACK),
+    (["unknown", MSGPACK, JSON], msgpack_protocol, MSGPACK),
+])
+def test_negotiate_picks_the_first_known_subprotocol(offered, protocol, subprotocol):
+    assert negotiate(offered) == (protocol, subprotocol)
+
+
+def test_msgpack_uses_compact_keys_and_epoch_milliseconds():
+    assert msgpack.unpackb(msgpack_protocol.encode(MESSAGE)) == COMPACT
+
+
+def test_msgpack_transcodes_broker_json_to_the_same_frame():
+    assert msgpack_protocol.transcode(dumps(MESSAGE)) == msgpack_protocol.encode(MESSAGE)
+
+
+def test_msgpack_expands_inbound_keys():
+    frame = msgpack.packb({"t": "send", "k": "group", "c": 3, "x": "hello", "f": "1"})
+    assert msgpack_protocol.decode(frame) == {"type": "send", "kind": "group", "chat_id": 3, "text": "hello", "ref": "1"}
+
+
+def test_json_transcode_is_the_broker_payload():
+    payload = dumps(MESSAGE)
+    assert json_protocol.transcode(payload) is payload
+
+
+def run_socket(websocket, scenario):
+    async def main():
+        manager = ConnectionManager(broker=InMemoryBroker())
+        await manager.start()
+        connection = await manager.connect(websocket, 1)
+        try:
+            return await scenario(manager, connection)
+        finally:
+            await asyncio.sleep(0)
+            manager.disconnect(connection)
+            await manager.stop()
+    return asyncio.run(main())
+
+
+def test_connect_accepts_the_negotiated_subprotocol_and_broadcasts_binary():
+    websocket = FakeWebSocket([MSGPACK])
+
+    async def scenario(manager, connection):
+        await manager.subscribe(connection, "chat", 7)
+        await manager.broadcast("chat", 7, MESSAGE)
+        return connection.protocol
+
+    assert run_socket(websocket, scenario) is msgpack_protocol
+    assert websocket.subprotocol == MSGPACK
+    assert [msgpack.unpackb(frame) for frame in websocket.sent] == [COMPACT]
+
+
+def test_text_frame_on_msgpack_socket_gets_an_error_frame():
+    valid = msgpack.packb({"t": "ping"})
+    websocket = FakeWebSocket([MSGPACK], [
+        {"type": "websocket.receive", "text": '{"type": "ping"}'},
+        {"type": "websocket.receive", "bytes": b"\xc1"},
+        {"type": "websocket.receive", "bytes": valid},
+    ])
+
+    async def scenario(manager, connection):
+        frame = await manager.receive(connection)
+        with pytest.raises(WebSocketDisconnect):
+            await manager.receive(connection)
+        return frame
+
+    assert run_socket(websocket, scenario) == {"type": "ping"}
+    errors = [msgpack.unpackb(frame) for frame in websocket.sent]
+    assert [error["t"] for error in errors] == ["error", "error"]
+    assert "binary" in errors[0]["e"]
+
+
+def test_malformed_json_gets_an_error_frame():
+    websocket = FakeWebSocket([], [
+        {"type": "websocket.receive", "text": "{not json"},
+        {"type": "websocket.receive", "text": '{"type": "ping"}'},
+    ])
+
+    async def scenario(manager, connection):
+        return await manager.receive(connection)
+
+    assert run_socket(websocket, scenario) == {"type": "ping"}
+    assert websocket.subprotocol is None
+    assert orjson.loads(websocket.sent[0])["type"] == "error"
+
+
+def test_protocol_base_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        Protocol()
+
+
+class BrokenWebSocket(FakeWebSocket):
+    def __init__(self):
+        super().__init__()
+        self.closed = False
+
+    async def receive(self):
+        while not self.closed:
+            await asyncio.sleep(0)
+        return {"type": "websocket.disconnect", "code": 1008}
+
+    async def send_text(self, data):
+        raise ConnectionResetError("peer is gone")
+
+    async def close(self, code=1000, reason=None):
+        self.closed = True
+
+
+def test_a_failed_writer_never_blocks_sends_and_closes_the_socket():
+    websocket = BrokenWebSocket()
+
+    async def main():
+        manager = ConnectionManager(broker=InMemoryBroker(), queue_size=2)
+        await manager.start()
+        connection = await manager.connect(websocket, 1)
+        try:
+            for _ in range(10):
+                await manager.send(connection, {"type": "pong"})
+            with pytest.raises(WebSocketDisconnect):
+                await asyncio.wait_for(manager.receive(connection), 1)
+            return connection in manager.connections
+        finally:
+            await manager.stop()
+
+    assert asyncio.run(main()) is False
+    assert websocket.closed
+
+
+@pytest.mark.parametrize("frame", [
+    {"type": "websocket.receive", "text": '{"type": "ping"}'},
+    {"type": "websocket.receive", "text": "not json"},
+])
+def test_every_inbound_frame_is_charged_to_the_frame_limiter(frame):
+    websocket = FakeWebSocket(frames=[frame] * 500)
+    limiter = RateLimiter("frame", 0.001, 40)
+
+    async def main():
+        manager = ConnectionManager(broker=InMemoryBroker(), queue_size=1000, limiter=limiter)
+        connection = await manager.connect(websocket, 1)
+        delivered = 0
+        try:
+            while True:
+                await manager.receive(connection)
+                delivered += 1
+        except WebSocketDisconnect:
+            pass
+        await asyncio.sleep(0)
+        manager.disconnect(connection)
+        return delivered
+
+    delivered = asyncio.run(main())
+    errors = [orjson.loads(sent) for sent in websocket.sent]
+
+    # Well-formed frames reach the handler; garbage only gets error replies.
+    assert delivered + len(errors) == 41
+    assert errors[-1] == {"type": "error", "error": "Rate limit exceeded", "retry_after": pytest.approx(1000, rel=0.1)}
@@ -0,0 +1,40 @@
+import pytest
+from starlette.requests import Request
+
+from app import ratelimit
+
+
+def make_request(peer: str, headers: dict) -> Request:
+    return Request({
+        "type": "http",
+        "client": (peer, 50000),
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_client_ip_ignores_header_by_default(monkeypatch):
+    monkeypatch.setattr(ratelimit, "CLIENT_IP_HEADER", "")
+    request = make_request("10.0.0.2", {"X-Forwarded-For": "203.0.113.7"})
+
+    assert ratelimit.client_ip(request) == "10.0.0.2"
+
+
+def test_client_ip_uses_header_from_trusted_proxy(monkeypatch):
+    monkeypatch.setattr(ratelimit, "CLIENT_IP_HEADER", "X-Forwarded-For")
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXIES", {"10.0.0.2"})
+    request = make_request("10.0.0.2", {"X-Forwarded-For": "198.51.100.1, 203.0.113.7"})
+
+    assert ratelimit.client_ip(request) == "203.0.113.7"
+
+
+def test_client_ip_ignores_header_from_untrusted_peer(monkeypatch):
+    monkeypatch.setattr(ratelimit, "CLIENT_IP_HEADER", "X-Forwarded-For")
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXIES", {"10.0.0.2"})
+    request = make_request("192.0.2.9", {"X-Forwarded-For": "203.0.113.7"})
+
+    assert ratelimit.client_ip(request) == "192.0.2.9"
+
+
+def test_rate_limit_backend_base_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        ratelimit.RateLimitBackend()
@@ -0,0 +1,22 @@
+import asyncio
+
+from app.repository import _split_headline, search_messages
+from conftest import RecordingSession, compile_sql
+
+
+def test_search_passes_the_text_search_config_as_regconfig():
+    db = RecordingSession([])
+    page = asyncio.run(search_messages(db, 1, "hello"))
+
+    sql = compile_sql(db.statements[0])
+    assert "websearch_to_tsquery('simple'::regconfig" in sql
+    assert "ts_headline('simple'::regconfig, translate(" in sql
+    assert "<b>" not in str(db.statements[0].compile().params)
+    assert page == {"hits": [], "next_cursor": None}
+
+
+def test_headline_markers_become_offsets_into_plain_text():
+    hit = _split_headline("<b>готов</b> \x02отчёт\x03 за \x02квартал\x03")
+
+    assert hit["snippet"] == "<b>готов</b> отчёт за квартал"
+    assert [hit["snippet"][start:end] for start, end in hit["highlights"]] == ["отчёт", "квартал"]
@@ -0,0 +1,104 @@
+import asyncio
+from datetime import timedelta
+
+from app.broker import InMemoryBroker
+from app.membership import CHAT
+from app.pagination import decode_cursor
+from app.tail_cache import TailCache, TailRing, _cost
+from app.websocket_manager import ConnectionManager
+from conftest import START, record
+
+
+def position(message_id: int):
+    return START + timedelta(seconds=message_id), message_id
+
+
+def ids(page) -> list:
+    return [message.id for message in page["messages"]]
+
+
+def test_deliveries_before_the_seed_are_buffered_untrimmed():
+    ring = TailRing()
+    for message_id in (6, 7, 8, 9):
+        ring.add(record(message_id), capacity=2)
+
+    assert not ring.complete
+    assert [message.id for message in ring.records] == [6, 7, 8, 9]
+
+
+def test_fill_merges_the_seed_with_buffered_deliveries_and_trims():
+    ring = TailRing()
+    ring.add(record(5), capacity=3)
+    # The seed overlaps the buffered delivery; it is kept once.
+    added = ring.fill([record(5), record(4), record(3), record(2)], exhaustive=False, capacity=3)
+
+    assert [message.id for message in ring.records] == [3, 4, 5]
+    assert ring.complete and not ring.exhaustive
+    assert ring.size == sum(_cost(message) for message in ring.records)
+    assert added == ring.size - _cost(record(5))
+
+
+def test_trimming_an_exhaustive_ring_makes_it_partial():
+    ring = TailRing()
+    ring.fill([record(2), record(1)], exhaustive=True, capacity=2)
+    assert ring.exhaustive
+
+    ring.add(record(3), capacity=2)
+
+    assert [message.id for message in ring.records] == [2, 3]
+    assert not ring.exhaustive
+
+
+def test_duplicate_delivery_is_ignored():
+    ring = TailRing()
+    ring.fill([record(1)], exhaustive=True, capacity=5)
+
+    assert ring.add(record(1), capacity=5) == 0
+    assert len(ring.records) == 1
+
+
+def test_page_before_uses_the_ring_only_when_it_can_answer():
+    ring = TailRing()
+    ring.fill([record(i) for i in range(10, 4, -1)], exhaustive=False, capacity=10)
+
+    page = ring.page(3)
+    assert ids(page) == [8, 9, 10]
+    assert decode_cursor(page["next_cursor"]) == position(8)
+    assert ids(ring.page(2, before=position(8))) == [6, 7]
+    # Older messages may exist in the database only.
+    assert ring.page(3, before=position(7)) is None
+
+
+def test_exhaustive_ring_answers_the_oldest_page_without_a_cursor():
+    ring = TailRing()
+    ring.fill([record(2), record(1)], exhaustive=True, capacity=10)
+
+    page = ring.page(5)
+    assert ids(page) == [1, 2]
+    assert page["next_cursor"] is None
+
+
+def test_disabled_cache_never_tracks_or_seeds():
+    cache = TailCache()
+    cache.enabled = False
+    cache.track(CHAT, 1)
+
+    assert cache.live == set()
+    assert asyncio.run(cache.page(CHAT, 1, 10)) is None
+    assert cache.rings == {}
+
+
+def test_cache_is_off_unless_the_broker_reaches_every_process(monkeypatch):
+    cache = TailCache()
+    monkeypatch.setattr("app.websocket_manager.tail_cache", cache)
+
+    async def start(shared: bool) -> bool:
+        broker = InMemoryBroker()
+        broker.shared = shared
+        manager = ConnectionManager(broker=broker)
+        await manager.start()
+        await manager.stop()
+        return cache.enabled
+
+    assert asyncio.run(start(False)) is False
+    assert asyncio.run(start(True)) is True
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import orjson
+
+from app import router
+from app.auth import CurrentUser
+from app.broker import InMemoryBroker
+from app.ingest import IngestFailed
+from app.membership import CHAT
+from app.pagination import decode_sync_cursor, encode_sync_cursor
+from app.presence import presence
+from app.serializers import MessageRecord
+from app.websocket_manager import ConnectionManager
+from conftest import RecordingSession
+from test_protocols import FakeWebSocket
+
+
+class DrainingWebSocket(FakeWebSocket):
+    # Lets the writer flush queued replies before the client disconnects.
+    async def receive(self):
+        if not self.frames:
+            await asyncio.sleep(0.01)
+        return await super().receive()
+
+
+def text_frame(frame) -> dict:
+    return {"type": "websocket.receive", "text": orjson.dumps(frame).decode()}
+
+
+def run_legacy_socket(monkeypatch, frames, submit, since=None) -> tuple[ConnectionManager, FakeWebSocket]:
+    manager = ConnectionManager(broker=InMemoryBroker())
+
+    async def authenticate(websocket):
+        return CurrentUser(id=1, name="alice")
+
+    async def allow(kind, conversation_id, user_id):
+        pass
+
+    monkeypatch.setattr(router, "authenticate_websocket", authenticate)
+    monkeypatch.setattr(router, "check_member", allow)
+    monkeypatch.setattr(router, "manager", manager)
+    monkeypatch.setattr(router.ingest, "submit", submit)
+    websocket = DrainingWebSocket(frames=frames)
+    websocket.query_params = {} if since is None else {"since": since}
+
+    async def main():
+        await manager.start()
+        try:
+            await router.websocket_endpoint(websocket, 7)
+            await asyncio.sleep(0)
+        finally:
+            await manager.stop()
+
+    asyncio.run(main())
+    return manager, websocket
+
+
+def test_legacy_socket_logs_unexpected_errors_and_cleans_up(monkeypatch, caplog):
+    async def fail(message_in, kind):
+        raise RuntimeError("database is gone")
+
+    with caplog.at_level(logging.ERROR, logger="app.router"):
+        manager, _ = run_legacy_socket(monkeypatch, [text_frame({"chat_id": 7, "sender_id": 1, "text": "hi"})], fail)
+
+    [record] = [record for record in caplog.records if record.name == "app.router"]
+    assert record.exc_info[0] is RuntimeError
+    assert not manager.connections
+    assert 1 not in presence.connections
+
+
+def test_legacy_socket_answers_a_failed_write_with_an_error_frame(monkeypatch):
+    async def fail(message_in, kind):
+        raise IngestFailed()
+
+    frames = [text_frame({"chat_id": 7, "sender_id": 1, "text": text}) for text in ("a", "b")]
+    _, websocket = run_legacy_socket(monkeypatch, frames, fail)
+
+    assert [orjson.loads(frame) for frame in websocket.sent] == [{"error": "Message could not be saved"}] * 2
+
+
+def test_legacy_socket_answers_a_non_object_frame_with_an_error(monkeypatch):
+    async def submit(message_in, kind):
+        raise AssertionError("nothing should be written")
+
+    frames = [text_frame([1, 2]), text_frame("text"), text_frame(3)]
+    manager, websocket = run_legacy_socket(monkeypatch, frames, submit)
+
+    assert [orjson.loads(frame) for frame in websocket.sent] == [{"error": "Frame must be a JSON object"}] * 3
+
+
+def test_resume_sends_recent_messages_without_moving_the_cursor(monkeypatch):
+    settled_at = (datetime(2026, 1, 1, tzinfo=timezone.utc), 4)
+    recent = MessageRecord(5, CHAT, 7, 2, "just sent", datetime(2026, 1, 1, 0, 1, tzinfo=timezone.utc), False, None)
+    reads = []
+
+    async def sync(db, user_id, since, limit, settled=True):
+        reads.append((since, settled))
+        messages = [] if settled else [recent]
+        return {"messages": messages, "next_cursor": encode_sync_cursor({CHAT: settled_at}), "has_more": False}
+
+    monkeypatch.setattr(router, "sync_messages", sync)
+    monkeypatch.setattr(router, "async_session", RecordingSession)
+    monkeypatch.setattr(router, "async_replica_session", RecordingSession)
+    _, websocket = run_legacy_socket(monkeypatch, [], None, since=encode_sync_cursor({CHAT: settled_at}))
+
+    assert reads == [({CHAT: settled_at}, True), ({CHAT: settled_at}, False)]
+    settled, unsettled = (orjson.loads(frame) for frame in websocket.sent)
+    assert settled["messages"] == []
+    assert [message["id"] for message in unsettled["messages"]] == [5]
+    assert decode_sync_cursor(unsettled["next_cursor"]) == {CHAT: settled_at}